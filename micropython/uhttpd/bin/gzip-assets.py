@@ -0,0 +1,93 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# Host-side build step that produces gzip sidecar files (e.g., foo.js.gz
+# alongside foo.js) for the text assets under one or more directories.  The
+# uhttpd.file_handler.Handler serves a sidecar in place of the original file
+# to clients that accept the gzip content coding.
+#
+# Run with python3 on the development host, and then upload the sidecars to
+# the device with the original files.
+#
+import gzip
+import os
+import sys
+
+SUFFIXES = (".html", ".js", ".css", ".map", ".json", ".svg", ".txt")
+
+
+def is_up_to_date(path, gzip_path):
+    return os.path.exists(gzip_path) \
+        and os.stat(gzip_path).st_mtime >= os.stat(path).st_mtime
+
+
+def compress(path, min_size):
+    gzip_path = path + ".gz"
+    size = os.stat(path).st_size
+    if size < min_size:
+        return remove(gzip_path)
+    if is_up_to_date(path, gzip_path):
+        return
+    with open(path, 'rb') as f:
+        data = gzip.compress(f.read(), 9, mtime=0)
+    #
+    # Only keep the sidecar if it actually saves bytes over the air
+    #
+    if len(data) >= size:
+        return remove(gzip_path)
+    with open(gzip_path, 'wb') as f:
+        f.write(data)
+    print("{} {} -> {} ({:.1f}x)".format(path, size, len(data), size / len(data)))
+
+
+def remove(gzip_path):
+    if os.path.exists(gzip_path):
+        os.remove(gzip_path)
+        print("removed {}".format(gzip_path))
+
+
+def run(dirs, clean=False, min_size=256):
+    for d in dirs:
+        for dirpath, dirnames, filenames in os.walk(d):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if clean:
+                    if filename.endswith(".gz") and os.path.exists(path[:-3]):
+                        remove(path)
+                elif filename.endswith(SUFFIXES):
+                    compress(path, min_size)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    clean = len(args) > 0 and args[0] == '-c'
+    if clean:
+        args = args[1:]
+    if len(args) < 1:
+        print("Syntax: gzip-assets.py [-c] <dir> [<dir>]*")
+        print("    -c  Remove sidecar files, instead of creating them")
+        sys.exit(1)
+    run(args, clean=clean)
@@ -0,0 +1,186 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# Host-side build step that packs the files under a directory into a single
+# bundle file, served on the device by uhttpd.bundle.Handler.  The bundle
+# contains an index of the files, sorted by path, with the offset, length,
+# modification time, content type, and entity tag of each file, followed by
+# the file contents.  See uhttpd/bundle.py for the layout.
+#
+# With the -m option, the files are instead written to a python module,
+# which may be frozen into the firmware and served by
+# uhttpd.frozen.Handler.  The module defines ASSETS, a tuple of (path,
+# content_type, etag, mtime, flags, data) tuples, sorted by path, where data
+# is a bytes constant.
+#
+# Gzip sidecar files (e.g., foo.js.gz alongside foo.js, as produced by
+# gzip-assets.py) are packed as the compressed variants of their original
+# files.  With the -z option, compressed variants are generated for text
+# assets, instead.
+#
+# Run with python3 on the development host, and then upload the bundle to
+# the device.
+#
+import getopt
+import gzip
+import hashlib
+import os
+import struct
+import sys
+
+MAGIC = b'UHB1'
+RECORD_FORMAT = "<IIIBHBB"
+RECORD_SIZE = 17
+FLAG_GZIP = 0x01
+
+#
+# The largest number of files, and the longest (UTF-8 encoded) path and
+# content type, that fit in the fields of the header and index records
+#
+MAX_FILES = 0xFFFF
+MAX_PATH_LENGTH = 0xFFFF
+MAX_TYPE_LENGTH = 0xFF
+
+CONTENT_TYPE_MAP = {
+    ".html": "text/html",
+    ".js": "text/javascript",
+    ".css": "text/css",
+    ".json": "application/json",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".gif": "image/gif",
+    ".ico": "image/x-icon"
+}
+
+SUFFIXES = (".html", ".js", ".css", ".map", ".json", ".svg", ".txt")
+
+
+def content_type(path):
+    return CONTENT_TYPE_MAP.get(os.path.splitext(path)[1], "text/plain")
+
+
+def etag(data, flags):
+    return '"{}{}"'.format(hashlib.sha1(data).hexdigest()[:16], "-gz" if flags & FLAG_GZIP else "")
+
+
+def collect(root, compress=False, min_size=256):
+    #
+    # Returns a list of (path, data, mtime, flags, content_type) tuples for
+    # the files under root, where path is relative to root, with a leading
+    # '/'
+    #
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            full_path = os.path.join(dirpath, filename)
+            path = '/' + os.path.relpath(full_path, root).replace(os.sep, '/')
+            with open(full_path, 'rb') as f:
+                data = f.read()
+            files[path] = [path, data, int(os.stat(full_path).st_mtime), 0, content_type(path)]
+    for path, entry in files.items():
+        if path.endswith(".gz") and path[:-3] in files:
+            entry[3] = FLAG_GZIP
+            entry[4] = content_type(path[:-3])
+    if compress:
+        for path, entry in list(files.items()):
+            data = entry[1]
+            if path.endswith(SUFFIXES) and len(data) >= min_size and path + ".gz" not in files:
+                gzip_data = gzip.compress(data, 9, mtime=0)
+                if len(gzip_data) < len(data):
+                    files[path + ".gz"] = [path + ".gz", gzip_data, entry[2], FLAG_GZIP, entry[4]]
+    return [tuple(files[path]) for path in sorted(files)]
+
+
+def pack(files):
+    if len(files) > MAX_FILES:
+        raise ValueError("Too many files: {} (at most {} may be packed)".format(len(files), MAX_FILES))
+    records = []
+    for path, data, mtime, flags, type in files:
+        record = (path.encode('UTF-8'), type.encode('UTF-8'), etag(data, flags).encode('UTF-8'), mtime, flags)
+        if len(record[0]) > MAX_PATH_LENGTH:
+            raise ValueError("Path too long: {} ({} bytes, at most {})".format(path, len(record[0]), MAX_PATH_LENGTH))
+        if len(record[1]) > MAX_TYPE_LENGTH:
+            raise ValueError("Content type too long: {} ({} bytes, at most {})".format(type, len(record[1]), MAX_TYPE_LENGTH))
+        records.append(record)
+    table_size = 4 * len(records)
+    index_size = sum(RECORD_SIZE + len(path) + len(type) + len(tag) for path, type, tag, _, _ in records)
+    record_offset = 8 + table_size
+    data_offset = record_offset + index_size
+    table = b''
+    index = b''
+    for (path, type, tag, mtime, flags), (_, data, _, _, _) in zip(records, files):
+        table += struct.pack("<I", record_offset)
+        record = struct.pack(RECORD_FORMAT, data_offset, len(data), mtime, flags, len(path), len(type), len(tag)) \
+            + path + type + tag
+        index += record
+        record_offset += len(record)
+        data_offset += len(data)
+    return struct.pack("<4sHH", MAGIC, len(records), 0) + table + index + b''.join(data for _, data, _, _, _ in files)
+
+
+def generate(root, files, line_size=64):
+    lines = [
+        "#",
+        "# Generated by pack-assets.py from {}.  Do not edit.".format(os.path.basename(root)),
+        "#",
+        "ASSETS = ("
+    ]
+    for path, data, mtime, flags, type in files:
+        lines.append("    ({!r}, {!r}, {!r}, {}, {}, (".format(path, type, etag(data, flags), mtime, flags))
+        for i in range(0, len(data), line_size):
+            lines.append("        {!r}".format(data[i:i + line_size]))
+        if not data:
+            lines.append("        b''")
+        lines.append("    )),")
+    lines.append(")")
+    return ("\n".join(lines) + "\n").encode('UTF-8')
+
+
+def run(root, output, compress=False, module=False):
+    files = collect(root, compress)
+    data = generate(root, files) if module else pack(files)
+    with open(output, 'wb') as f:
+        f.write(data)
+    print("{}: {} files, {} bytes".format(output, len(files), len(data)))
+
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], "zmo:")
+    opts = dict(opts)
+    if len(args) != 1:
+        print("Syntax: pack-assets.py [-z] [-m] [-o <output>] <dir>")
+        print("    -z  Pack gzip compressed variants of text assets")
+        print("    -m  Write a python module, for freezing, instead of a bundle")
+        print("    -o  The file to write (default: <dir>.bundle, or <dir>_assets.py, with -m)")
+        sys.exit(1)
+    root = args[0].rstrip('/')
+    module = '-m' in opts
+    try:
+        run(root, opts.get('-o', root + ("_assets.py" if module else ".bundle")), '-z' in opts, module)
+    except ValueError as e:
+        print("pack-assets.py: {}".format(e))
+        sys.exit(1)
@@ -0,0 +1,65 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+#
+# Runs the test server (see ../test/test_server.py) under CPython, e.g.,
+#
+#     prompt$ python3 host/run_server.py -p 8080 -r /tmp/uhttpd-test
+#
+# With -m, allocations are traced, so that the heap figures reported by
+# the server (e.g., in its metrics) reflect the memory used by python
+# objects.
+#
+import sys
+import os
+import getopt
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'test'))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+
+
+def main(args):
+    try:
+        opts, args = getopt.getopt(args, "p:r:m")
+    except getopt.GetoptError as e:
+        print(e)
+        print("Syntax: run_server.py [-p <port>] [-r <root>] [-m]")
+        return 1
+    opts = dict(opts)
+    port = int(opts.get('-p', 8080))
+    root_path = opts.get('-r', '/tmp/uhttpd-test')
+    import uhttpd_host
+    uhttpd_host.install('-m' in opts)
+    import test_server
+    test_server.init(root_path=root_path)
+    test_server.run(root_path=root_path, port=port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,153 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+#
+# Host (CPython) stand-in for the (generator based) MicroPython uasyncio
+# module, implemented on top of asyncio.  Coroutines are plain generators
+# that use yield from, as on MicroPython, and asyncio awaitables are
+# adapted to them with _await.
+#
+import asyncio as _asyncio
+import types as _types
+
+TimeoutError = _asyncio.TimeoutError
+CancelledError = _asyncio.CancelledError
+
+
+@_types.coroutine
+def _await(aw):
+    return (yield from aw)
+
+
+def coroutine(f):
+    return f
+
+
+def sleep(secs):
+    return _await(_asyncio.sleep(secs))
+
+
+def sleep_ms(ms):
+    return _await(_asyncio.sleep(ms / 1000))
+
+
+def wait_for(coro, timeout):
+    return _await(_asyncio.wait_for(_await(coro), timeout))
+
+
+def wait_for_ms(coro, timeout):
+    return wait_for(coro, timeout / 1000)
+
+
+class StreamReader:
+    def __init__(self, reader):
+        self._reader = reader
+
+    def readline(self):
+        return _await(self._reader.readline())
+
+    def read(self, n=-1):
+        return _await(self._reader.read(n))
+
+    def readexactly(self, n):
+        return _await(self._reader.readexactly(n))
+
+
+class StreamWriter:
+    def __init__(self, writer):
+        self._writer = writer
+        self.extra = {'peername': writer.get_extra_info('peername')}
+
+    def awrite(self, buf, off=0, sz=-1):
+        if isinstance(buf, str):
+            buf = buf.encode('UTF-8')
+        if sz == -1:
+            sz = len(buf) - off
+        self._writer.write(bytes(buf[off:off + sz]))
+        return _await(self._writer.drain())
+
+    @_types.coroutine
+    def aclose(self):
+        self._writer.close()
+        try:
+            yield from self._writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+def start_server(client_coro, host, port, backlog=10):
+    def accept(reader, writer):
+        _asyncio.ensure_future(
+            _await(client_coro(StreamReader(reader), StreamWriter(writer))))
+    server = yield from _await(_asyncio.start_server(
+        accept, host, port, backlog=backlog, reuse_address=True))
+    yield from _await(server.serve_forever())
+
+
+class _Loop:
+    def __init__(self, loop):
+        self._loop = loop
+
+    def create_task(self, coro):
+        return self._loop.create_task(_await(coro))
+
+    def call_soon(self, callback, *args):
+        if isinstance(callback, _types.GeneratorType):
+            return self.create_task(callback)
+        return self._loop.call_soon(callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        return self._loop.call_later(delay, callback, *args)
+
+    def call_later_ms(self, delay, callback, *args):
+        return self._loop.call_later(delay / 1000, callback, *args)
+
+    def run_forever(self):
+        self._loop.run_forever()
+
+    def run_until_complete(self, coro):
+        return self._loop.run_until_complete(_await(coro))
+
+    def stop(self):
+        self._loop.stop()
+
+    def close(self):
+        self._loop.close()
+
+
+_loop = None
+
+
+def get_event_loop(*args, **kwargs):
+    global _loop
+    if _loop is None:
+        try:
+            loop = _asyncio.get_event_loop()
+        except RuntimeError:
+            loop = _asyncio.new_event_loop()
+            _asyncio.set_event_loop(loop)
+        _loop = _Loop(loop)
+    return _loop
@@ -0,0 +1,84 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# Compares serving the files in a directory tree from the file system with
+# serving the same files from a bundle produced by bin/pack-assets.py, e.g.,
+#
+#     shell$ python3 bin/pack-assets.py -o www.bundle www
+#
+# and then, with both www and www.bundle uploaded to the device,
+#
+#     >>> import bench_bundle
+#     >>> bench_bundle.run('/www', '/www.bundle')
+#
+# To also compare serving the files from a module generated with the -m
+# option (and, ideally, frozen into the firmware), pass its ASSETS, e.g.,
+#
+#     >>> import www_assets
+#     >>> bench_bundle.run('/www', '/www.bundle', www_assets.ASSETS)
+#
+import uhttpd.file_handler
+import uhttpd.bundle
+import uhttpd.frozen
+import bench_util
+
+
+def serve(handler, prefix, paths, stream):
+    for path in paths:
+        entry = handler.lookup(prefix + path)
+        bench_util.drain(handler.create_file_response(entry)['body'](stream))
+
+
+def time_it(handler, prefix, paths, iterations):
+    stream = bench_util.NullStream()
+
+    us, alloc = bench_util.measure(lambda: serve(handler, prefix, paths, stream), iterations, stream)
+    n = len(paths)
+    return us / n, alloc / n, stream.length / (iterations * n)
+
+
+def report(name, us, alloc, length):
+    print("{}: {:.2f} ms/response, {:.1f} bytes/response, {:.1f} bytes allocated/response".format(
+        name, us / 1000, length, alloc))
+
+
+def run(root_path='/www', bundle_path='/www.bundle', assets=None, iterations=5):
+    bundle = uhttpd.bundle.Bundle(bundle_path)
+    paths = []
+    for i in range(len(bundle)):
+        path = bundle.read_record(i)[0]
+        if not path.endswith(".gz"):
+            paths.append(path)
+    print("Serving {} files, {} iterations".format(len(paths), iterations))
+    for max_cache_entries in (0, 32):
+        print("max_cache_entries={}".format(max_cache_entries))
+        report("files",  *time_it(uhttpd.file_handler.Handler(
+            root_path, max_cache_entries=max_cache_entries), root_path, paths, iterations))
+        report("bundle", *time_it(uhttpd.bundle.Handler(
+            bundle, max_cache_entries=max_cache_entries), '', paths, iterations))
+    if assets is not None:
+        report("frozen", *time_it(uhttpd.frozen.Handler(assets), '', paths, iterations))
+    bundle.close()
@@ -0,0 +1,77 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import uos
+import uhttpd.file_handler
+import bench_util
+
+
+def make_file(path, size):
+    block = bytes(range(256)) * 4
+    with open(path, 'wb') as f:
+        while size > 0:
+            f.write(block[:min(size, len(block))])
+            size -= len(block)
+
+
+#
+# The streaming loop used before send buffers were pooled, which allocates
+# a buffer per response and a copy of each block
+#
+def stream_file_copy(handler, stream, path):
+    buf = bytearray(handler._block_size)
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if n:
+                yield from stream.awrite(buf[:n])
+            else:
+                break
+
+
+def time_it(f, path, iterations):
+    stream = bench_util.NullStream()
+
+    us, alloc = bench_util.measure(lambda: bench_util.drain(f(stream, path)), iterations, stream)
+    return us, alloc, stream.length / iterations
+
+
+def report(name, us, alloc, length):
+    print("{}: {:.1f} ms/response, {:.1f} KB/s, {:.1f} bytes allocated/response".format(
+        name, us / 1000, length * 1000000 / us / 1024, alloc))
+
+
+def run(root_path='/bench', size=100 * 1024, block_size=1024, iterations=10):
+    try:
+        uos.mkdir(root_path)
+    except OSError:
+        pass
+    path = "{}/bench.bin".format(root_path)
+    make_file(path, size)
+    handler = uhttpd.file_handler.Handler(root_path=root_path, block_size=block_size)
+    print("Streaming a {} byte file in {} byte blocks, {} iterations".format(size, block_size, iterations))
+    report("copy",   *time_it(lambda stream, path: stream_file_copy(handler, stream, path), path, iterations))
+    report("pooled", *time_it(handler.stream_file, path, iterations))
+    uos.remove(path)
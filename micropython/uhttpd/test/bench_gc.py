@@ -0,0 +1,75 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import gc
+import utime
+import uhttpd.gc_policy
+
+
+def make_garbage(size):
+    #
+    # Stands in for handling a request, which allocates (and drops) a few
+    # strings and dictionaries
+    #
+    ret = []
+    for i in range(size // 64):
+        ret.append({'i': i, 's': "{:056d}".format(i)})
+    return len(ret)
+
+
+def time_it(policy, connections, requests, size):
+    stats = {}
+    gc.collect()
+    policy.install(stats)
+    start = utime.ticks_us()
+    for i in range(connections):
+        policy.on_connect()
+        for j in range(requests):
+            make_garbage(size)
+            policy.on_request()
+        policy.on_close()
+    elapsed = utime.ticks_diff(utime.ticks_us(), start)
+    return elapsed, stats
+
+
+def run(connections=10, requests=10, size=1024):
+    print("{} connections x {} requests, each allocating about {} bytes".format(connections, requests, size))
+    threshold = gc.threshold()
+    try:
+        for name, policy in [
+            ('always', uhttpd.gc_policy.Always()),
+            ('watermark', uhttpd.gc_policy.Watermark()),
+            ('allocation', uhttpd.gc_policy.AllocationRate()),
+            ('threshold', uhttpd.gc_policy.Threshold()),
+            ('none', uhttpd.gc_policy.Policy())
+        ]:
+            elapsed, stats = time_it(policy, connections, requests, size)
+            gc.threshold(threshold)
+            print("{:10s} {:.1f} us/request, {} collections, {} us max pause, {} bytes min free".format(
+                name, elapsed / (connections * requests), stats['gc_collections'],
+                stats['gc_max_pause_us'], stats['gc_min_free']
+            ))
+    finally:
+        gc.threshold(threshold)
@@ -0,0 +1,81 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import uhttpd.router
+import bench_util
+
+
+class Endpoint:
+    def __init__(self):
+        pass
+
+    def get(self, api_request):
+        return None
+
+
+def make_routes(n=32):
+    routes = []
+    for i in range(n):
+        routes.append((['gateway', "device{}".format(i), 'stats'], Endpoint()))
+    routes.append((['neolamp', 'schedule', '{name}'], Endpoint()))
+    routes.append(([], Endpoint()))
+    return routes
+
+
+#
+# The linear scan api_handler used before routes were compiled into a trie
+#
+def find_linear(routes, components):
+    for prefix, handler in routes:
+        prefix_len = len(prefix)
+        if prefix == components[:prefix_len]:
+            return prefix, handler, components[prefix_len:]
+    return None
+
+
+def time_it(f, paths, iterations):
+    def dispatch():
+        for components in paths:
+            f(components)
+
+    us, alloc = bench_util.measure(dispatch, iterations)
+    return us / len(paths), alloc / len(paths)
+
+
+def run(n=32, iterations=100):
+    routes = make_routes(n)
+    router = uhttpd.router.Router(routes)
+    paths = [
+        ['gateway', 'device0', 'stats'],
+        ['gateway', "device{}".format(n // 2), 'stats'],
+        ['gateway', "device{}".format(n - 1), 'stats', 'extra'],
+        ['neolamp', 'schedule', 'morning'],
+        ['unknown']
+    ]
+    print("Dispatching {} paths over {} routes, {} iterations".format(len(paths), len(routes), iterations))
+    us, alloc = time_it(lambda components: find_linear(routes, components), paths, iterations)
+    print("linear: {:.1f} us/dispatch, {:.1f} bytes/dispatch".format(us, alloc))
+    us, alloc = time_it(router.find, paths, iterations)
+    print("trie:   {:.1f} us/dispatch, {:.1f} bytes/dispatch".format(us, alloc))
@@ -0,0 +1,77 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import uhttpd
+import bench_util
+
+
+#
+# The serialization used before status lines and headers were precomputed
+#
+def lookup_code(code):
+    if code == 200:
+        return "OK"
+    elif code == 404:
+        return "Not Found"
+    else:
+        return "Unknown"
+
+
+def serialize_format(stream, response):
+    headers = response['headers']
+    headers.update({'Server': "uhttpd/{} (running in your devices)".format(uhttpd.VERSION)})
+    ret = ""
+    for k, v in headers.items():
+        ret += "{}: {}\r\n".format(k, v)
+    yield from stream.awrite("{}\r\n{}\r\n".format(
+        "HTTP/1.1 {} {}".format(response['code'], lookup_code(response['code'])), ret
+    ).encode('UTF-8'))
+
+
+def make_response():
+    return {
+        'code': 200,
+        'headers': {
+            'content-type': "application/json",
+            'content-length': 1342,
+            'connection': 'keep-alive',
+            'keep-alive': "timeout=5, max=100"
+        }
+    }
+
+
+def time_it(f, iterations):
+    stream = bench_util.NullStream()
+    response = make_response()
+
+    return bench_util.measure(lambda: bench_util.drain(f(stream, response)), iterations)
+
+
+def run(iterations=100):
+    print("Serializing response headers, {} iterations".format(iterations))
+    us, alloc = time_it(serialize_format, iterations)
+    print("format:      {:.1f} us/response, {:.1f} bytes allocated/response".format(us, alloc))
+    us, alloc = time_it(uhttpd.Server.serialize, iterations)
+    print("precomputed: {:.1f} us/response, {:.1f} bytes allocated/response".format(us, alloc))
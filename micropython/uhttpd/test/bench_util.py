@@ -0,0 +1,112 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# Helpers shared by the bench_*.py scripts
+#
+import gc
+import utime
+
+
+class NullStream:
+    #
+    # Stands in for the client connection, counting and discarding what is
+    # written
+    #
+    def __init__(self):
+        self.length = 0
+        self.allocations = None
+
+    def awrite(self, buf, off=0, sz=-1):
+        if sz == -1:
+            sz = len(buf) - off
+        self.length += sz
+        if self.allocations is not None:
+            self.allocations.sample()
+        if False:
+            yield
+
+    def flush(self):
+        if False:
+            yield
+
+
+def drain(gen):
+    #
+    # Runs a coroutine (that never actually waits) to completion, and
+    # returns its result
+    #
+    try:
+        while True:
+            next(gen)
+    except StopIteration as e:
+        return e.value
+
+
+class Allocations:
+    #
+    # Sums the bytes allocated between calls to sample.  The heap is
+    # collected after each sample, so no collection runs (and hides
+    # allocations) in between, as long as less than the free heap is
+    # allocated between samples.
+    #
+    def __init__(self):
+        self.total = 0
+        gc.collect()
+        self._last = gc.mem_alloc()
+
+    def sample(self):
+        self.total += gc.mem_alloc() - self._last
+        gc.collect()
+        self._last = gc.mem_alloc()
+
+
+def measure(f, n=1, stream=None):
+    #
+    # Calls f n times, with the garbage collector enabled, and returns the
+    # time taken (in microseconds) and the number of bytes allocated per
+    # call.  The calls are timed in one pass, and then repeated in a second
+    # pass, in which allocations are sampled after each call, and after
+    # each write to stream (a NullStream), if given, so that a call may
+    # allocate more than the free heap in total, if not between writes.
+    #
+    gc.collect()
+    start = utime.ticks_us()
+    for i in range(n):
+        f()
+    elapsed = utime.ticks_diff(utime.ticks_us(), start)
+    allocations = Allocations()
+    if stream is not None:
+        length = stream.length
+        stream.allocations = allocations
+    try:
+        for i in range(n):
+            f()
+            allocations.sample()
+    finally:
+        if stream is not None:
+            stream.length = length
+            stream.allocations = None
+    return elapsed / n, allocations.total / n
@@ -0,0 +1,88 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import uhttpd.websocket
+import bench_util
+
+
+class BytesReader:
+    #
+    # Stands in for the client connection, reading from a byte string
+    #
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def read(self, n=-1):
+        if False:
+            yield
+        pos = self._pos
+        end = len(self._data) if n < 0 else min(pos + n, len(self._data))
+        self._pos = end
+        return self._data[pos:end]
+
+
+#
+# Unmasking a byte at a time, for comparison
+#
+def unmask_bytes(data, mask):
+    ret = bytearray(data)
+    for i in range(len(ret)):
+        ret[i] ^= mask[i & 3]
+    return bytes(ret)
+
+
+def make_frames(size, count):
+    import ustruct
+    mask = b'\x12\x34\x56\x78'
+    payload = bytes(i & 0xFF for i in range(size))
+    if size < 126:
+        header = ustruct.pack('BB', 0x82, 0x80 | size)
+    else:
+        header = ustruct.pack('>BBH', 0x82, 0x80 | 126, size)
+    return (header + mask + uhttpd.websocket.unmask(payload, mask)) * count
+
+
+def run_echo(data, size, count, stream):
+    ws = uhttpd.websocket.WebSocket(BytesReader(data), stream, None, max_message_size=size)
+    for i in range(count):
+        bench_util.drain(ws.send(bench_util.drain(ws.recv())))
+
+
+def run(size=1024, count=20):
+    print("Echoing {} masked {} byte WebSocket messages".format(count, size))
+    payload = bytes(i & 0xFF for i in range(size))
+    mask = b'\x12\x34\x56\x78'
+    us, alloc = bench_util.measure(lambda: unmask_bytes(payload, mask), count)
+    print("unmask, bytewise: {:.1f} us/message, {:.1f} bytes allocated/message".format(us, alloc))
+    us, alloc = bench_util.measure(lambda: uhttpd.websocket.unmask(payload, mask), count)
+    print("unmask, integer:  {:.1f} us/message, {:.1f} bytes allocated/message".format(us, alloc))
+    data = make_frames(size, count)
+    stream = bench_util.NullStream()
+    us, alloc = bench_util.measure(lambda: run_echo(data, size, count, stream), 1, stream)
+    us /= count
+    alloc /= count
+    print("receive and send: {:.1f} us/message ({:.1f} KB/s), {:.1f} bytes allocated/message".format(
+        us, size * 1000000 / us / 1024 if us else 0, alloc))
@@ -0,0 +1,190 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# Drives a uhttpd server with a number of concurrent clients, each of which
+# sends requests one after another over a persistent (keep-alive)
+# connection, and reports the request rate, latency percentiles, and the
+# growth of the server heap (as reported by its metrics handler, if any).
+#
+import sys
+import time
+import getopt
+import asyncio
+import binascii
+
+
+class Client:
+    def __init__(self, host, port, path, headers):
+        self.host = host
+        self.port = port
+        self.request = "GET {} HTTP/1.1\r\nhost: {}\r\n{}\r\n".format(
+            path, host, "".join("{}: {}\r\n".format(k, v) for k, v in headers.items())
+        ).encode()
+        self.reader = None
+        self.writer = None
+        self.connections = 0
+
+    async def get(self):
+        #
+        # Returns the status and body of the response, reconnecting first if
+        # the server closed the connection after the last response
+        #
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            self.connections += 1
+        self.writer.write(self.request)
+        await self.writer.drain()
+        status, headers, body = await read_response(self.reader)
+        if headers.get('connection') == 'close':
+            self.close()
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+async def read_response(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed")
+    status = int(line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, value = line.decode().split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding') == 'chunked':
+        body = b''
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                await reader.readline()
+                break
+            body += await reader.readexactly(size)
+            await reader.readline()
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+    return status, headers, body
+
+
+async def run_client(client, requests, latencies, codes, errors):
+    for i in range(requests):
+        start = time.perf_counter()
+        try:
+            status, body = await client.get()
+        except (ConnectionError, OSError, ValueError, asyncio.IncompleteReadError) as e:
+            errors.append(e)
+            client.close()
+            continue
+        latencies.append(time.perf_counter() - start)
+        codes[status] = codes.get(status, 0) + 1
+    client.close()
+
+
+async def heap_alloc(host, port, headers):
+    #
+    # Returns the allocated bytes on the server heap, from its metrics, or
+    # None, if the server does not expose them
+    #
+    client = Client(host, port, '/metrics', headers)
+    try:
+        status, body = await client.get()
+    except (ConnectionError, OSError):
+        return None
+    finally:
+        client.close()
+    if status != 200:
+        return None
+    for line in body.decode().splitlines():
+        if line.startswith('uhttpd_heap_alloc_bytes '):
+            return int(line.split()[1])
+    return None
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run(host, port, path, clients, requests, headers):
+    before = await heap_alloc(host, port, headers)
+    latencies = []
+    codes = {}
+    errors = []
+    pool = [Client(host, port, path, headers) for i in range(clients)]
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(client, requests, latencies, codes, errors) for client in pool])
+    elapsed = time.perf_counter() - start
+    after = await heap_alloc(host, port, headers)
+    latencies.sort()
+    print("{} clients x {} requests to {}".format(clients, requests, path))
+    print("responses:   {} ({}), {} failed, over {} connections".format(
+        len(latencies), ", ".join("{}: {}".format(code, n) for code, n in sorted(codes.items())),
+        len(errors), sum(client.connections for client in pool)
+    ))
+    print("throughput:  {:.1f} req/s".format(len(latencies) / elapsed if elapsed else 0))
+    print("latency:     p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+        (latencies[-1] if latencies else 0) * 1000
+    ))
+    if before is not None and after is not None:
+        print("server heap: {} -> {} bytes allocated ({:+d})".format(before, after, after - before))
+    else:
+        print("server heap: unknown (no /metrics handler)")
+    return 1 if errors or list(codes) != [200] else 0
+
+
+def main(args):
+    syntax = "Syntax: load_client.py [-c <clients>] [-n <requests>] [-p <path>] [-u <user:password>] <host> [<port>]"
+    try:
+        opts, args = getopt.getopt(args, "c:n:p:u:")
+    except getopt.GetoptError as e:
+        print(e)
+        print(syntax)
+        return 1
+    if len(args) < 1:
+        print(syntax)
+        return 1
+    opts = dict(opts)
+    host = args[0]
+    port = int(args[1]) if len(args) > 1 else 80
+    headers = {}
+    if '-u' in opts:
+        headers['authorization'] = "Basic {}".format(binascii.b2a_base64(opts['-u'].encode()).decode().strip())
+    return asyncio.run(run(
+        host, port, opts.get('-p', '/'), int(opts.get('-c', 4)), int(opts.get('-n', 100)), headers
+    ))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
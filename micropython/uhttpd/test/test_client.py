@@ -23,6 +23,7 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
+import json
 import unittest
 import threading
 import time
@@ -74,6 +75,72 @@ def get_header(el, name):
     return None
 
 
+def read_all(s):
+    ret = b''
+    while True:
+        buf = s.recv(1024)
+        if not buf:
+            return ret
+        ret += buf
+
+
+def websocket_connect(path='/ws', version='13'):
+    import socket
+    import base64
+    import os
+    key = base64.b64encode(os.urandom(16)).decode()
+    s = socket.create_connection((host, int(port)))
+    s.settimeout(5)
+    s.sendall(
+        "GET {} HTTP/1.1\r\nauthorization: {}\r\nupgrade: websocket\r\nconnection: Upgrade\r\n"
+        "sec-websocket-key: {}\r\nsec-websocket-version: {}\r\n\r\n".format(
+            path, basic_auth_headers('admin', 'uhttpD')['authorization'], key, version
+        ).encode()
+    )
+    response = b''
+    while b'\r\n\r\n' not in response:
+        data = s.recv(1)
+        if not data:
+            break
+        response += data
+    return s, key, response
+
+
+def websocket_send(s, op, payload, fin=True):
+    import os
+    import struct
+    n = len(payload)
+    if n < 126:
+        header = struct.pack('!BB', (0x80 if fin else 0) | op, 0x80 | n)
+    elif n < 0x10000:
+        header = struct.pack('!BBH', (0x80 if fin else 0) | op, 0x80 | 126, n)
+    else:
+        header = struct.pack('!BBQ', (0x80 if fin else 0) | op, 0x80 | 127, n)
+    mask = os.urandom(4)
+    s.sendall(header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload)))
+
+
+def recv_exactly(s, n):
+    ret = b''
+    while len(ret) < n:
+        data = s.recv(n - len(ret))
+        if not data:
+            raise EOFError()
+        ret += data
+    return ret
+
+
+def websocket_recv(s):
+    import struct
+    b0, b1 = recv_exactly(s, 2)
+    n = b1 & 0x7F
+    if n == 126:
+        n = struct.unpack('!H', recv_exactly(s, 2))[0]
+    elif n == 127:
+        n = struct.unpack('!Q', recv_exactly(s, 8))[0]
+    return b0 & 0x80, b0 & 0x0F, recv_exactly(s, n)
+
+
 def make_headers(size):
     ret = {}
     for i in range(size):
@@ -106,7 +173,21 @@ class HttpdTest(unittest.TestCase):
         self.verify_get('/test/index.html', expected_status=200, expected_content_type='text/html')
 
     def test_dir_listing(self):
-        self.verify_get('/test/foo', expected_status=200, expected_content_type='text/html')
+        response = self.verify_get('/test/foo', expected_status=200, expected_content_type='text/html')
+        self.assertEqual(get_header(response['headers'], 'transfer-encoding'), 'chunked')
+        self.assertIn(b'<li><a href="/">..</a></li>', response['body'])
+        self.assertIn(b'<li><a href="/foo/test.txt">test.txt</a></li>', response['body'])
+        self.assertIn(b'<li><a href="/foo/bar">bar</a></li>', response['body'])
+        self.assertTrue(response['body'].endswith(b'</ul></body></html>'))
+        response = self.verify_get('/test/foo', expected_status=200, expected_content_type='application/json',
+            additional_headers={'accept': 'application/json'})
+        listing = json.loads(response['body'])
+        self.assertEqual('/foo', listing['path'])
+        entries = dict((entry['name'], entry) for entry in listing['entries'])
+        self.assertEqual('file', entries['test.txt']['type'])
+        self.assertEqual(4, entries['test.txt']['size'])
+        self.assertEqual('dir', entries['bar']['type'])
+        self.assertIn('mtime', entries['bar'])
 
     def test_not_found(self):
         self.verify_get('/test/bar', expected_status=404, expected_content_type='text/html')
@@ -123,6 +204,99 @@ class HttpdTest(unittest.TestCase):
         self.verify_get('/test/foo/bar/test.js', expected_status=200, expected_content_type='text/javascript', expected_body=b'{\'foo\': "bar"}')
         self.verify_get('/test/foo/bar/test.css', expected_status=200, expected_content_type='text/css', expected_body=b'html')
 
+    def test_conditional_get(self):
+        response = self._connection.get('/test/foo/test.txt', headers=basic_auth_headers('admin', 'uhttpD'))
+        self.assertEqual(200, response['status'])
+        etag = get_header(response['headers'], 'etag')
+        self.assertIsNotNone(etag)
+        self.verify_get('/test/foo/test.txt', expected_status=304, additional_headers={'if-none-match': etag}, expected_body=b'')
+        self.verify_get('/test/foo/test.txt', expected_status=304, additional_headers={'if-none-match': '"other", {}'.format(etag)})
+        self.verify_get('/test/foo/test.txt', expected_status=200, additional_headers={'if-none-match': '"other"'}, expected_body=b'test')
+        self.verify_get('/test', expected_status=304, additional_headers={'if-none-match': '*'}, expected_body=b'')
+        last_modified = get_header(response['headers'], 'last-modified')
+        if last_modified is not None:
+            self.verify_get('/test/foo/test.txt', expected_status=304, additional_headers={'if-modified-since': last_modified})
+
+    def test_gzip_sidecar(self):
+        import gzip
+        headers = basic_auth_headers('admin', 'uhttpD')
+        response = self._connection.get('/test/foo/bar/test.js', headers=headers)
+        self.assertEqual(200, response['status'])
+        self.assertIsNone(get_header(response['headers'], 'content-encoding'))
+        self.assertEqual('accept-encoding', get_header(response['headers'], 'vary'))
+        self.assertEqual(b'{\'foo\': "bar"}', response['body'])
+        headers['accept-encoding'] = 'deflate, gzip'
+        response = self._connection.get('/test/foo/bar/test.js', headers=headers)
+        self.assertEqual(200, response['status'])
+        self.assertEqual('gzip', get_header(response['headers'], 'content-encoding'))
+        self.assertEqual('text/javascript', get_header(response['headers'], 'content-type'))
+        self.assertEqual(b'{\'foo\': "bar"}', gzip.decompress(response['body']))
+        self.verify_get('/test/foo/bar/test.js', expected_status=304, additional_headers={'accept-encoding': 'gzip', 'if-none-match': get_header(response['headers'], 'etag')})
+        self.verify_get('/test/foo/bar/test.js', expected_status=200, additional_headers={'accept-encoding': 'gzip;q=0', 'if-none-match': get_header(response['headers'], 'etag')}, expected_body=b'{\'foo\': "bar"}')
+        self.verify_get('/test/foo/test.txt', expected_status=200, additional_headers={'accept-encoding': 'gzip'}, expected_body=b'test')
+
+    def test_range(self):
+        self.verify_range('/test/foo/test.txt', 'bytes=1-2', 206, b'es', 'bytes 1-2/4')
+        self.verify_range('/test/foo/test.txt', 'bytes=2-', 206, b'st', 'bytes 2-3/4')
+        self.verify_range('/test/foo/test.txt', 'bytes=-3', 206, b'est', 'bytes 1-3/4')
+        self.verify_range('/test/foo/test.txt', 'bytes=1-100', 206, b'est', 'bytes 1-3/4')
+        self.verify_range('/test/foo/test.txt', 'bytes=-100', 206, b'test', 'bytes 0-3/4')
+        self.verify_range('/test/foo/test.txt', 'bytes=4-', 416, b'', 'bytes */4')
+        self.verify_range('/test/foo/test.txt', 'bytes=-0', 416, b'', 'bytes */4')
+        self.verify_range('/test/foo/test.txt', 'bytes=0-1,2-3', 200, b'test', None)
+        self.verify_range('/test/foo/test.txt', 'bytes=3-1', 200, b'test', None)
+        self.verify_range('/test/foo/test.txt', 'lines=1-2', 200, b'test', None)
+        etag = get_header(self._connection.get('/test/foo/test.txt', headers=basic_auth_headers('admin', 'uhttpD'))['headers'], 'etag')
+        self.verify_range('/test/foo/test.txt', 'bytes=1-2', 206, b'es', 'bytes 1-2/4', {'if-range': etag})
+        self.verify_range('/test/foo/test.txt', 'bytes=1-2', 200, b'test', None, {'if-range': '"stale"'})
+        data = bytes(range(256)) * 16
+        response = self._connection.put('/upload/range.bin', headers=basic_auth_headers('admin', 'uhttpD'), body=data)
+        self.assertIn(response['status'], [201, 204])
+        self.verify_range('/upload/range.bin', 'bytes=1000-3000', 206, data[1000:3001], 'bytes 1000-3000/4096')
+        self.verify_range('/upload/range.bin', 'bytes=-1025', 206, data[-1025:], 'bytes 3071-4095/4096')
+
+    def test_bundle(self):
+        import gzip
+        self.verify_get('/bundle', expected_status=200, expected_content_type='text/html', expected_body=b'<html><body>Hello World!</body></html>')
+        self.verify_get('/bundle/foo/test.txt', expected_status=200, expected_content_type='text/plain', expected_body=b'test')
+        self.verify_get('/bundle/foo/test.js', expected_status=404, expected_content_type='text/html')
+        self.verify_range('/bundle/foo/test.txt', 'bytes=1-2', 206, b'es', 'bytes 1-2/4')
+        headers = basic_auth_headers('admin', 'uhttpD')
+        headers['accept-encoding'] = 'gzip'
+        response = self._connection.get('/bundle/foo/bar/test.js', headers=headers)
+        self.assertEqual(200, response['status'])
+        self.assertEqual('gzip', get_header(response['headers'], 'content-encoding'))
+        self.assertEqual('text/javascript', get_header(response['headers'], 'content-type'))
+        self.assertEqual(b'{\'foo\': "bar"}', gzip.decompress(response['body']))
+        self.verify_get('/bundle/foo/bar/test.js', expected_status=304, additional_headers={'accept-encoding': 'gzip', 'if-none-match': get_header(response['headers'], 'etag')})
+        self.verify_get('/bundle/foo/bar/test.js', expected_status=200, expected_body=b'{\'foo\': "bar"}')
+        response = self.verify_get('/bundle/foo', expected_status=200, expected_content_type='application/json', additional_headers={'accept': 'application/json'})
+        listing = json.loads(response['body'].decode('UTF-8'))
+        self.assertEqual('/foo', listing['path'])
+        self.assertEqual([('bar', 'dir', 0, 1476384271), ('test.txt', 'file', 4, 1476384271)],
+            [(e['name'], e['type'], e['size'], e['mtime']) for e in listing['entries']])
+
+    def test_frozen(self):
+        import gzip
+        self.verify_get('/frozen', expected_status=200, expected_content_type='text/html', expected_body=b'<html><body>Hello World!</body></html>')
+        self.verify_get('/frozen/foo/test.txt', expected_status=200, expected_content_type='text/plain', expected_body=b'test')
+        self.verify_get('/frozen/foo/test.js', expected_status=404, expected_content_type='text/html')
+        self.verify_range('/frozen/foo/test.txt', 'bytes=1-2', 206, b'es', 'bytes 1-2/4')
+        headers = basic_auth_headers('admin', 'uhttpD')
+        headers['accept-encoding'] = 'gzip'
+        response = self._connection.get('/frozen/foo/bar/test.js', headers=headers)
+        self.assertEqual(200, response['status'])
+        self.assertEqual('gzip', get_header(response['headers'], 'content-encoding'))
+        self.assertEqual(b'{\'foo\': "bar"}', gzip.decompress(response['body']))
+        self.verify_get('/frozen/foo/bar/test.js', expected_status=304, additional_headers={'accept-encoding': 'gzip', 'if-none-match': get_header(response['headers'], 'etag')})
+        self.verify_get('/frozen/foo/bar/test.js', expected_status=200, expected_body=b'{\'foo\': "bar"}')
+        response = self.verify_get('/frozen/foo', expected_status=200, expected_content_type='text/html')
+        self.assertIn(b'<li><a href="/foo/bar">bar</a></li>', response['body'])
+        response = self.verify_get('/frozen/foo', expected_status=200, expected_content_type='application/json', additional_headers={'accept': 'application/json'})
+        listing = json.loads(response['body'].decode('UTF-8'))
+        self.assertEqual([('bar', 'dir', 0, 1476384271), ('test.txt', 'file', 4, 1476384271)],
+            [(e['name'], e['type'], e['size'], e['mtime']) for e in listing['entries']])
+
     def test_out_of_range(self):
         self.verify_get('/test/..', expected_status=403, expected_content_type='text/html')
 
@@ -131,10 +305,75 @@ class HttpdTest(unittest.TestCase):
         with self.assertRaises(ConnectionResetError):
             self.verify_get('/test', expected_status=400, additional_headers=make_headers(55))
 
+    def test_max_header_size(self):
+        self.verify_get('/test', expected_status=400, additional_headers={'x-large': 'x' * 4096})
+        # typical browser headers fit
+        self.verify_get('/test', expected_status=200, additional_headers={
+            'user-agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+            'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+            'accept-language': 'en-US,en;q=0.9',
+            'accept-encoding': 'gzip, deflate',
+            'cookie': 'x' * 600
+        })
+
+    def test_header_value(self):
+        self.verify_get('/api/test/header?name=x-test', expected_status=200, expected_content_type='application/json',
+            additional_headers={'X-Test': 'a:b: c '}, expected_body=b'{"value": "a:b: c"}')
+        self.verify_get('/api/test/header?name=x-missing', expected_status=200, expected_content_type='application/json',
+            expected_body=b'{"value": null}')
+
     def test_max_body(self):
         # server should drop the connection with ESP8266, but not unix micropython
         self.verify_put('/test', expected_status=400, body=bytearray(2048))
 
+    def test_invalid_content_length(self):
+        import socket
+        for value in ('-5', 'abc', '1e3'):
+            s = socket.create_connection((host, int(port)))
+            s.settimeout(5)
+            try:
+                s.sendall("PUT /body HTTP/1.1\r\nauthorization: {}\r\ncontent-length: {}\r\n\r\n".format(
+                    basic_auth_headers('admin', 'uhttpD')['authorization'], value
+                ).encode())
+                self.assertTrue(read_all(s).startswith(b'HTTP/1.1 400 '))
+            finally:
+                s.close()
+
+    def test_chunked_request_body(self):
+        self.verify_chunked_put('/api/test', [b'{"a": ', b'1}'], expected_status=200, expected_body=b'{"action": "put"}',
+            additional_headers={'content-type': "application/json"})
+        self.verify_chunked_put('/api/test', [b'not ', b'JSON'], expected_status=400,
+            additional_headers={'content-type': "application/json"})
+        self.verify_chunked_put('/api/test', [bytes(512)] * 4, expected_status=400)
+
+    def test_chunked_request_body_stream(self):
+        data = bytes(range(256)) * 40
+        chunks = [data[i:i + 1000] for i in range(0, len(data), 1000)]
+        self.verify_chunked_put('/body', chunks, expected_status=200,
+            expected_body='{{"length": {}, "checksum": {}}}'.format(len(data), sum(data) & 0xFFFF).encode())
+
+    def test_chunked_response(self):
+        # TestBodyHandler responses have no content-length
+        response = self._connection.get('/body', headers=basic_auth_headers('admin', 'uhttpD'))
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(get_header(response['headers'], 'transfer-encoding'), 'chunked')
+        self.assertEqual(response['body'], b'{"length": 0, "checksum": 0}')
+
+    def test_file_handler_put(self):
+        data = bytes(range(256)) * 40
+        response = self._connection.put('/upload/test.bin', headers=basic_auth_headers('admin', 'uhttpD'), body=data)
+        self.assertIn(response['status'], [201, 204])
+        self.verify_get('/upload/test.bin', expected_status=200, expected_body=data)
+        self.verify_chunked_put('/upload/test.bin', [data[:1000], data[1000:]], expected_status=204)
+        self.verify_get('/upload/test.bin', expected_status=200, expected_body=data)
+        self.verify_put('/upload/test.bin', expected_status=400, body=bytes(20 * 1024))
+        self.verify_get('/upload/test.bin', expected_status=200, expected_body=data)
+        self.verify_put('/upload/../test.bin', expected_status=403, body=data)
+        self.verify_put('/upload/no-such-dir/test.bin', expected_status=404, body=data)
+        etag = get_header(self._connection.get('/upload/test.bin', headers=basic_auth_headers('admin', 'uhttpD'))['headers'], 'etag')
+        self.verify_put('/upload/test.bin', expected_status=204, body=data[:100])
+        self.verify_get('/upload/test.bin', expected_status=200, additional_headers={'if-none-match': etag}, expected_body=data[:100])
+
     def test_file_handler_put_fail(self):
         # should be a bad request
         self.verify_put('/test', expected_status=400, expected_content_type='text/html')
@@ -144,6 +383,32 @@ class HttpdTest(unittest.TestCase):
         self.verify_get('/test', expected_status=401, expected_content_type='text/html', additional_headers=basic_auth_headers('unknown-user', 'knockknock'))
         self.verify_get('/test', expected_status=200, expected_content_type='text/html', additional_headers=basic_auth_headers('admin', 'uhttpD'))
 
+    def test_session_cookie(self):
+        # (a lower case scheme, so that the credentials are not already cached)
+        headers = {'authorization': basic_auth_headers('admin', 'uhttpD')['authorization'].replace('Basic', 'basic')}
+        response = self._connection.get('/test', headers=headers)
+        self.assertEqual(200, response['status'])
+        cookie = get_header(response['headers'], 'set-cookie').split(';')[0]
+        self.assertTrue(cookie.startswith('uhttpd_session=admin:'))
+        # a session is only created when the credentials are verified
+        response = self._connection.get('/test', headers=headers)
+        self.assertEqual(200, response['status'])
+        self.assertIsNone(get_header(response['headers'], 'set-cookie'))
+        # the session cookie authenticates the client without credentials
+        response = self._connection.get('/test', headers={'cookie': "foo=bar; {}".format(cookie)})
+        self.assertEqual(200, response['status'])
+        self.assertIsNone(get_header(response['headers'], 'set-cookie'))
+        # a forged cookie does not
+        name, user, expires, signature = cookie.replace('=', ':', 1).split(':')
+        forged = "uhttpd_session={}:{}:{}".format(user, int(expires) + 3600, signature)
+        response = self._connection.get('/test', headers={'cookie': forged})
+        self.assertEqual(401, response['status'])
+        response = self._connection.get('/test', headers={'cookie': cookie[:-1] + ('0' if cookie[-1] != '0' else '1')})
+        self.assertEqual(401, response['status'])
+        # cookie names must match exactly
+        response = self._connection.get('/test', headers={'cookie': 'x' + cookie})
+        self.assertEqual(401, response['status'])
+
     def test_api_json_body(self):
         self.verify_put('/api/test', expected_status=200, body="this is clearly not JSON", additional_headers={'content-type': "text/plain"})
         self.verify_put('/api/test', expected_status=400, body="this is clearly not JSON", additional_headers={'content-type': "application/json"})
@@ -157,6 +422,11 @@ class HttpdTest(unittest.TestCase):
         self.verify_post('/api/test', expected_status=200, expected_content_type='application/json', expected_body=b'{"action": "post"}')
         self.verify_delete('/api/test', expected_status=200, expected_content_type='application/json', expected_body=b'{"action": "delete"}')
 
+    def test_api_path_params(self):
+        self.verify_get('/api/test/items/foo', expected_status=200, expected_content_type='application/json', expected_body=b'{"name": "foo", "context": []}')
+        self.verify_get('/api/test/items/foo/bar', expected_status=200, expected_content_type='application/json', expected_body=b'{"name": "foo", "context": ["bar"]}')
+        self.verify_put('/api/test/items/foo', expected_status=400, expected_content_type='text/html')
+
     def test_api_bad_query_params(self):
         self.verify_get('/api/test?foo', expected_status=400, expected_content_type='text/html')
         self.verify_get('/api/test?foo?', expected_status=400, expected_content_type='text/html')
@@ -176,6 +446,68 @@ class HttpdTest(unittest.TestCase):
         self.verify_get('/api/test/int', expected_status=200, expected_content_type="text/plain", expected_body=b'1342')
         self.verify_get('/api/test/float', expected_status=200, expected_content_type="text/plain", expected_body=b'3.14159')
 
+    def test_api_stream_json(self):
+        for what in ['json', 'large', 'query_params?foo=bar']:
+            expected = self._connection.get('/api/test/{}'.format(what), headers=basic_auth_headers('admin', 'uhttpD'))
+            response = self._connection.get('/stream/test/{}'.format(what), headers=basic_auth_headers('admin', 'uhttpD'))
+            self.assertEqual(response['status'], 200)
+            self.assertEqual(get_header(response['headers'], 'transfer-encoding'), 'chunked')
+            self.assertEqual(get_header(response['headers'], 'content-type'), 'application/json')
+            self.assertEqual(response['body'], expected['body'])
+
+    def test_api_async(self):
+        self.verify_get('/api/test/async', expected_status=200, expected_content_type='application/json', expected_body=b'{"async": true}')
+        # a slow coroutine does not hold up other requests
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            self._connection.get('/api/test/sleep?ms=1500', headers=basic_auth_headers('admin', 'uhttpD'))
+        ))
+        thread.start()
+        try:
+            time.sleep(0.2)
+            start = time.time()
+            self.verify_get('/api/test', expected_status=200, expected_body=b'{"action": "get"}')
+            self.assertLess(time.time() - start, 1.0)
+            self.assertEqual([], results)
+        finally:
+            thread.join()
+        self.assertEqual(200, results[0]['status'])
+        self.assertEqual(b'{"slept": 1500}', results[0]['body'])
+
+    def test_api_cache(self):
+        auth = basic_auth_headers('admin', 'uhttpD')
+        response = self._connection.get('/api/test/cached', headers=auth)
+        self.assertEqual(200, response['status'])
+        count = json.loads(response['body'])['count']
+        # served from the cache
+        response = self._connection.get('/api/test/cached', headers=auth)
+        self.assertEqual(count, json.loads(response['body'])['count'])
+        self.assertIsNotNone(get_header(response['headers'], 'age'))
+        # query strings are cached separately
+        response = self._connection.get('/api/test/cached?x=1', headers=auth)
+        self.assertEqual(count + 1, json.loads(response['body'])['count'])
+        # the client may bypass the cache
+        response = self._connection.get('/api/test/cached', headers=dict(auth, **{'cache-control': 'no-cache'}))
+        self.assertEqual(count + 2, json.loads(response['body'])['count'])
+        response = self._connection.get('/api/test/cached', headers=auth)
+        self.assertEqual(count + 2, json.loads(response['body'])['count'])
+        # a modification invalidates the cache
+        self.verify_put('/api/test/cached', expected_status=200)
+        response = self._connection.get('/api/test/cached', headers=auth)
+        self.assertEqual(count + 3, json.loads(response['body'])['count'])
+        # streamed responses are cached if they fit in the cache
+        response = self._connection.get('/stream/cached', headers=auth)
+        count = json.loads(response['body'])['count']
+        response = self._connection.get('/stream/cached', headers=auth)
+        self.assertEqual(count, json.loads(response['body'])['count'])
+        self.assertIsNotNone(get_header(response['headers'], 'age'))
+        # and are streamed, otherwise
+        response = self._connection.get('/stream/cached/large', headers=auth)
+        self.assertEqual(200, response['status'])
+        self.assertEqual('chunked', get_header(response['headers'], 'transfer-encoding'))
+        self.assertIsNone(get_header(response['headers'], 'age'))
+        self.assertEqual(200, len(json.loads(response['body'])))
+
     def test_api_exception(self):
         self.verify_get('/api/test/bad_request_excetion', expected_status=400, expected_content_type="text/html")
         self.verify_get('/api/test/not_found_excetion', expected_status=404, expected_content_type="text/html")
@@ -185,6 +517,249 @@ class HttpdTest(unittest.TestCase):
         self.verify_get('/api/test/html', expected_status=200, expected_content_type="text/html; charset=utf-8",
             expected_body="<html><body><h1>HTML</h1></body></html>".encode("UTF-8"))
 
+    def test_metrics(self):
+        self.verify_get('/api/test', expected_status=200)
+        self.verify_get('/api/nothing-here', expected_status=404)
+        response = self._connection.get('/metrics', headers=basic_auth_headers('admin', 'uhttpD'))
+        self.assertEqual(200, response['status'])
+        self.assertTrue(get_header(response['headers'], 'content-type').startswith('text/plain'))
+        lines = response['body'].decode().split('\n')
+        self.assertIn('# TYPE uhttpd_handler_seconds histogram', lines)
+        for prefix in [
+            'uhttpd_requests_total{route="/api",code="200"} ',
+            'uhttpd_requests_total{route="/api",code="404"} ',
+            'uhttpd_parse_seconds_bucket{route="/api",le="+Inf"} ',
+            'uhttpd_handler_seconds_sum{route="/api"} ',
+            'uhttpd_write_seconds_count{route="/api"} ',
+            'uhttpd_received_bytes_total{route="/api"} ',
+            'uhttpd_sent_bytes_total{route="/api"} ',
+            'uhttpd_active_connections ',
+            'uhttpd_new_connections_total ',
+            'uhttpd_gc_collections_total ',
+            'uhttpd_gc_min_free ',
+            'uhttpd_heap_free_bytes '
+        ]:
+            self.assertTrue([line for line in lines if line.startswith(prefix)], prefix)
+
+    def test_keep_alive(self):
+        import http.client
+        connection = http.client.HTTPConnection(host, int(port))
+        try:
+            for i in range(3):
+                connection.request("GET", '/api/test', headers=basic_auth_headers('admin', 'uhttpD'))
+                response = connection.getresponse()
+                self.assertEqual(response.status, 200)
+                self.assertEqual(response.getheader('connection'), 'keep-alive')
+                self.assertEqual(response.read(), b'{"action": "get"}')
+        finally:
+            connection.close()
+
+    def test_keep_alive_errors(self):
+        import http.client
+        connection = http.client.HTTPConnection(host, int(port))
+        try:
+            # a 401 and a 404 leave the connection open for the next request
+            connection.request("GET", '/api/test')
+            response = connection.getresponse()
+            self.assertEqual(response.status, 401)
+            self.assertEqual(response.getheader('connection'), 'keep-alive')
+            response.read()
+            connection.request("GET", '/nonexistent', headers=basic_auth_headers('admin', 'uhttpD'))
+            response = connection.getresponse()
+            self.assertEqual(response.status, 404)
+            self.assertEqual(response.getheader('connection'), 'keep-alive')
+            self.assertEqual(int(response.getheader('content-length')), len(response.read()))
+            connection.request("GET", '/api/test', headers=basic_auth_headers('admin', 'uhttpD'))
+            response = connection.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.read(), b'{"action": "get"}')
+            # a request that cannot be read in full closes it
+            connection.request("POST", '/api/test', body=b'x' * 2048, headers=basic_auth_headers('admin', 'uhttpD'))
+            response = connection.getresponse()
+            self.assertEqual(response.status, 400)
+            self.assertEqual(response.getheader('connection'), 'close')
+        finally:
+            connection.close()
+
+    def test_connection_close(self):
+        response = self._connection.get('/api/test', headers=dict(basic_auth_headers('admin', 'uhttpD'), connection='close'))
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(get_header(response['headers'], 'connection'), 'close')
+
+    def test_pipelining(self):
+        import socket
+        request = "GET /api/test HTTP/1.1\r\nauthorization: {}\r\n{}\r\n".format(
+            basic_auth_headers('admin', 'uhttpD')['authorization'], "{}"
+        )
+        data = (request.format("") + request.format("connection: close\r\n")).encode()
+        s = socket.create_connection((host, int(port)))
+        try:
+            s.sendall(data)
+            response = b''
+            while True:
+                buf = s.recv(1024)
+                if not buf:
+                    break
+                response += buf
+        finally:
+            s.close()
+        self.assertEqual(response.count(b'HTTP/1.1 200 OK'), 2)
+        self.assertEqual(response.count(b'{"action": "get"}'), 2)
+
+    def test_max_connections(self):
+        import socket
+        address = (host, int(port))
+        request = "GET /api/test HTTP/1.1\r\nauthorization: {}\r\nconnection: close\r\n\r\n".format(
+            basic_auth_headers('admin', 'uhttpD')['authorization']
+        ).encode()
+        # hold all of the connection slots (4, in the test server), and fill the queue (2)
+        held = [socket.create_connection(address) for i in range(4)]
+        queued = []
+        try:
+            time.sleep(0.5)
+            queued = [socket.create_connection(address) for i in range(2)]
+            time.sleep(0.5)
+            rejected = socket.create_connection(address)
+            try:
+                response = read_all(rejected)
+            finally:
+                rejected.close()
+            self.assertTrue(response.startswith(b'HTTP/1.1 503 Service Unavailable\r\n'))
+            self.assertIn(b'retry-after: 5\r\n', response)
+            # free up slots for the queued connections
+            held.pop().close()
+            held.pop().close()
+            for s in queued:
+                s.sendall(request)
+                response = read_all(s)
+                self.assertTrue(response.startswith(b'HTTP/1.1 200 OK\r\n'))
+        finally:
+            for s in held + queued:
+                s.close()
+
+    def test_events(self):
+        import socket
+        s = socket.create_connection((host, int(port)))
+        try:
+            s.sendall("GET /events HTTP/1.1\r\nauthorization: {}\r\n\r\n".format(
+                basic_auth_headers('admin', 'uhttpD')['authorization']
+            ).encode())
+            s.settimeout(5)
+            response = b''
+            while b'\r\n\r\n' not in response:
+                response += s.recv(1024)
+            self.assertTrue(response.startswith(b'HTTP/1.1 200 OK\r\n'))
+            self.assertIn(b'content-type: text/event-stream\r\n', response)
+            # events published while the stream is open are pushed to it
+            headers = dict(basic_auth_headers('admin', 'uhttpD'), **{'content-type': 'application/json'})
+            result = self._connection.post('/api/test/publish?event=color', headers, '{"color": "red"}')
+            self.assertEqual(200, result['status'])
+            event_id = json.loads(result['body'])['id']
+            expected = "id: {}\nevent: color\ndata: {{\"color\": \"red\"}}\n\n".format(event_id).encode()
+            while expected not in response:
+                response += s.recv(1024)
+        finally:
+            s.close()
+        # a new subscriber is sent the latest event
+        s = socket.create_connection((host, int(port)))
+        try:
+            s.sendall("GET /events HTTP/1.1\r\nauthorization: {}\r\n\r\n".format(
+                basic_auth_headers('admin', 'uhttpD')['authorization']
+            ).encode())
+            s.settimeout(5)
+            response = b''
+            while expected not in response:
+                response += s.recv(1024)
+        finally:
+            s.close()
+        # the streams end (freeing their connection slots) once the server
+        # notices the clients have gone away
+        for i in range(50):
+            result = self._connection.post('/api/test/publish', headers, '{}')
+            if json.loads(result['body'])['subscribers'] == 0:
+                break
+            time.sleep(0.1)
+        self.assertEqual(0, json.loads(result['body'])['subscribers'])
+
+    def test_websocket(self):
+        import base64
+        import hashlib
+        s, key, response = websocket_connect()
+        try:
+            self.assertTrue(response.startswith(b'HTTP/1.1 101 Switching Protocols\r\n'))
+            accept = base64.b64encode(hashlib.sha1(key.encode() + b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11').digest())
+            self.assertIn(b'sec-websocket-accept: ' + accept + b'\r\n', response)
+            self.assertNotIn(b'content-length', response)
+            # text and binary messages
+            websocket_send(s, 0x1, "h\u00e9llo".encode('UTF-8'))
+            self.assertEqual((0x80, 0x1, "h\u00e9llo".encode('UTF-8')), websocket_recv(s))
+            websocket_send(s, 0x2, bytes(range(256)) * 2)
+            self.assertEqual((0x80, 0x2, bytes(range(256)) * 2), websocket_recv(s))
+            # a fragmented message, with a ping in the middle
+            websocket_send(s, 0x1, b'foo', fin=False)
+            websocket_send(s, 0x9, b'ping')
+            self.assertEqual((0x80, 0xA, b'ping'), websocket_recv(s))
+            websocket_send(s, 0x0, b'bar', fin=False)
+            websocket_send(s, 0x0, b'gnu')
+            self.assertEqual((0x80, 0x1, b'foobargnu'), websocket_recv(s))
+            # close
+            websocket_send(s, 0x8, b'\x03\xe8')
+            self.assertEqual((0x80, 0x8, b'\x03\xe8'), websocket_recv(s))
+            self.assertEqual(b'', s.recv(1))
+        finally:
+            s.close()
+
+    def test_websocket_errors(self):
+        s, key, response = websocket_connect(version='8')
+        try:
+            self.assertTrue(response.startswith(b'HTTP/1.1 426 Upgrade Required\r\n'))
+            self.assertIn(b'sec-websocket-version: 13\r\n', response)
+        finally:
+            s.close()
+        self.verify_get('/ws', expected_status=400)
+        # messages over the maximum size close the connection
+        s, key, response = websocket_connect()
+        try:
+            self.assertTrue(response.startswith(b'HTTP/1.1 101 Switching Protocols\r\n'))
+            websocket_send(s, 0x2, b'x' * (16 * 1024 + 1))
+            self.assertEqual((0x80, 0x8, b'\x03\xf1'), websocket_recv(s))
+        finally:
+            s.close()
+
+    def test_websocket_throughput(self):
+        s, key, response = websocket_connect()
+        try:
+            self.assertTrue(response.startswith(b'HTTP/1.1 101 Switching Protocols\r\n'))
+            message = bytes(random.getrandbits(8) for i in range(1024))
+            for i in range(200):
+                websocket_send(s, 0x2, message)
+                self.assertEqual((0x80, 0x2, message), websocket_recv(s))
+            websocket_send(s, 0x8, b'')
+            self.assertEqual(0x8, websocket_recv(s)[1])
+        finally:
+            s.close()
+
+    def test_timeouts(self):
+        import socket
+        address = (host, int(port))
+        authorization = "authorization: {}\r\n".format(basic_auth_headers('admin', 'uhttpD')['authorization'])
+        idle = socket.create_connection(address)
+        partial_headers = socket.create_connection(address)
+        partial_body = socket.create_connection(address)
+        try:
+            partial_headers.sendall("GET /api/test HTTP/1.1\r\n{}".format(authorization).encode())
+            partial_body.sendall("PUT /api/test HTTP/1.1\r\n{}content-length: 10\r\n\r\n12345".format(authorization).encode())
+            # the test server times out after 2 seconds
+            start = time.time()
+            self.assertEqual(b'', read_all(idle))
+            self.assertTrue(read_all(partial_headers).startswith(b'HTTP/1.1 408 Request Timeout\r\n'))
+            self.assertTrue(read_all(partial_body).startswith(b'HTTP/1.1 408 Request Timeout\r\n'))
+            self.assertLess(time.time() - start, 10)
+        finally:
+            idle.close()
+            partial_headers.close()
+            partial_body.close()
+
     def verify_get(
         self, context, body=None, additional_headers={},
         expected_status=None, expected_content_type=None, expected_body=None
@@ -237,6 +812,38 @@ class HttpdTest(unittest.TestCase):
             expected_body=expected_body
         )
 
+    def verify_range(self, context, range, expected_status, expected_body, expected_content_range, additional_headers={}):
+        headers = basic_auth_headers('admin', 'uhttpD')
+        headers['range'] = range
+        headers.update(additional_headers)
+        response = self._connection.get(context, headers=headers)
+        self.assertEqual(expected_status, response['status'])
+        self.assertEqual(expected_body, response['body'])
+        self.assertEqual(expected_content_range, get_header(response['headers'], 'content-range'))
+        if expected_status != 416:
+            self.assertEqual('bytes', get_header(response['headers'], 'accept-ranges'))
+
+    def verify_chunked_put(
+        self, context, chunks, additional_headers={},
+        expected_status=None, expected_content_type=None, expected_body=None
+    ):
+        import http.client
+        headers = basic_auth_headers("admin", "uhttpD")
+        headers.update(additional_headers)
+        connection = http.client.HTTPConnection(host, int(port))
+        try:
+            connection.request("PUT", context, body=iter(chunks), headers=headers, encode_chunked=True)
+            response = connection.getresponse()
+            body = response.read()
+            if expected_status:
+                self.assertEqual(response.status, expected_status)
+            if expected_content_type:
+                self.assertEqual(response.getheader('content-type'), expected_content_type)
+            if expected_body:
+                self.assertEqual(body, expected_body)
+        finally:
+            connection.close()
+
     def verify_action(
         self, action,
         expected_status=None, expected_content_type=None, expected_body=None,
@@ -251,6 +858,7 @@ class HttpdTest(unittest.TestCase):
             self.assertEqual(get_header(response['headers'], 'content-type'), expected_content_type)
         if expected_body:
             self.assertEqual(response['body'], expected_body)
+        return response
 
 
     # TODO these tests are failing.  boo.
@@ -34,8 +34,8 @@ def mkdir(path):
         pass
 
 
-def write(filename, str):
-    f = open(filename, 'w')
+def write(filename, str, mode='w'):
+    f = open(filename, mode)
     f.write(str)
     f.close()
 
@@ -49,6 +49,42 @@ def init(root_path='/test'):
     mkdir('{}/foo/bar'.format(root_path))
     write('{}/foo/bar/test.js'.format(root_path), "{'foo': \"bar\"}")
     write('{}/foo/bar/test.css'.format(root_path), "html")
+    write('{}/foo/bar/test.js.gz'.format(root_path), b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\x03\xabVO\xcb\xcfW\xb7RPJJ,R\xaa\x05\x00\x836\x11W\x0e\x00\x00\x00', 'wb')
+    mkdir('{}/upload'.format(root_path))
+    #
+    # The files above, packed with bin/pack-assets.py
+    #
+    write('{}.bundle'.format(root_path), (
+        b'UHB1\x04\x00\x00\x00\x18\x00\x00\x00Z\x00\x00\x00\xa2\x00\x00\x00\xdc\x00\x00\x00\x13\x01\x00\x00\x0e\x00\x00\x00\x0f\xd6\xffW\x00\x10\x00\x0f'
+        b'\x12/foo/bar/test.jstext/javascript"0f2393c'
+        b'1e5da5262"!\x01\x00\x00"\x00\x00\x00\x0f\xd6\xffW\x01\x13\x00\x0f\x15/foo/bar/test'
+        b'.js.gztext/javascript"4bd0814c0720d6ff-g'
+        b'z"C\x01\x00\x00\x04\x00\x00\x00\x0f\xd6\xffW\x00\r\x00\n\x12/foo/test.txttext/pla'
+        b'in"a94a8fe5ccb19ba6"G\x01\x00\x00&\x00\x00\x00\x0f\xd6\xffW\x00\x0b\x00\t\x12/in'
+        b'dex.htmltext/html"dbad7dc66ab8c922"{\'foo'
+        b'\': "bar"}\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\x03\xabVO\xcb\xcfW\xb7RPJJ,R\xaa\x05\x00\x836\x11W\x0e'
+        b'\x00\x00\x00test<html><body>Hello World!</body></'
+        b'html>'
+    ), 'wb')
+
+
+#
+# The files written by init, as generated by bin/pack-assets.py -m
+#
+ASSETS = (
+    ('/foo/bar/test.js', 'text/javascript', '"0f2393c1e5da5262"', 1476384271, 0, (
+        b'{\'foo\': "bar"}'
+    )),
+    ('/foo/bar/test.js.gz', 'text/javascript', '"4bd0814c0720d6ff-gz"', 1476384271, 1, (
+        b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\x03\xabVO\xcb\xcfW\xb7RPJJ,R\xaa\x05\x00\x836\x11W\x0e\x00\x00\x00'
+    )),
+    ('/foo/test.txt', 'text/plain', '"a94a8fe5ccb19ba6"', 1476384271, 0, (
+        b'test'
+    )),
+    ('/index.html', 'text/html', '"dbad7dc66ab8c922"', 1476384271, 0, (
+        b'<html><body>Hello World!</body></html>'
+    )),
+)
 
 
 class TestAPIHandler:
@@ -73,10 +109,15 @@ class TestAPIHandler:
                 return "<html><body><h1>HTML</h1></body></html>"
             elif what_to_return == "json":
                 return {'some': [{'j': 1, 's': [], 'o': "str", 'n': {"дружище": "バディ"}}]}
+            elif what_to_return == "large":
+                return [{'i': i, 's': "line\n\"{}\"".format(i), 'f': i / 4, 'b': i % 2 == 0, 'n': None} for i in range(200)]
             elif what_to_return == "int":
                 return 1342
             elif what_to_return == "float":
                 return 3.14159
+            elif what_to_return == "header":
+                headers = api_request['http']['headers']
+                return {'value': headers.get(api_request['query_params']['name'])}
             elif what_to_return == "bad_request_excetion":
                 raise uhttpd.BadRequestException("derp")
             elif what_to_return == "not_found_excetion":
@@ -96,6 +137,89 @@ class TestAPIHandler:
         return {'action': 'delete'}
 
 
+class TestAsyncAPIHandler:
+    #
+    # An API handler that sleeps (without blocking the event loop) for the
+    # number of milliseconds in the ms query parameter
+    #
+    def __init__(self):
+        pass
+
+    def get(self, api_request):
+        import uasyncio
+        ms = int(api_request['query_params'].get('ms', 0))
+        yield from uasyncio.sleep_ms(ms)
+        return {'slept': ms}
+
+
+class TestCountingAPIHandler:
+    #
+    # An API handler that returns the number of times it has been called,
+    # used to verify response caching
+    #
+    def __init__(self):
+        self._count = 0
+
+    def get(self, api_request):
+        self._count += 1
+        return {'count': self._count}
+
+    def put(self, api_request):
+        return None
+
+
+def make_async_get(value):
+    #
+    # Returns a coroutine closure, which is not a generator function by
+    # type on MicroPython
+    #
+    def get(api_request):
+        import uasyncio
+        yield from uasyncio.sleep_ms(1)
+        return {'async': value}
+    return get
+
+
+class TestBodyHandler:
+    stream_body = True
+
+    def __init__(self):
+        pass
+
+    def handle_request(self, http_request):
+        length = 0
+        checksum = 0
+        reader = http_request.get('body_reader')
+        if reader:
+            while True:
+                data = yield from reader.read(64)
+                if not data:
+                    break
+                length += len(data)
+                for b in data:
+                    checksum = (checksum + b) & 0xFFFF
+        data = "{{\"length\": {}, \"checksum\": {}}}".format(length, checksum).encode('UTF-8')
+        return {
+            'code': 200,
+            'headers': {
+                'content-type': "application/json"
+            },
+            'body': lambda stream: stream.awrite(data)
+        }
+
+
+def websocket_echo(ws):
+    #
+    # Echoes messages back to the client, until the client closes the
+    # connection
+    #
+    while True:
+        message = yield from ws.recv()
+        if message is None:
+            break
+        yield from ws.send(message)
+
+
 server = None
 
 def run(root_path='/test', port=80, backlog=10):
@@ -103,18 +227,64 @@ def run(root_path='/test', port=80, backlog=10):
     import uhttpd
     import uhttpd.file_handler
     file_handler = uhttpd.file_handler.Handler(root_path=root_path)
-    import uhttpd.api_handler
-    api_handler = uhttpd.api_handler.Handler(
-        [(['test'], TestAPIHandler())]
+    import uhttpd.bundle
+    bundle_handler = uhttpd.bundle.Handler('{}.bundle'.format(root_path))
+    import uhttpd.frozen
+    frozen_handler = uhttpd.frozen.Handler(ASSETS)
+    upload_handler = uhttpd.file_handler.Handler(
+        root_path='{}/upload'.format(root_path), writable=True, max_body_length=16 * 1024
     )
+    import uhttpd.auth
+    import uhttpd.websocket
+    import uhttpd.sse
+    hub = uhttpd.sse.Hub()
+    import uhttpd.api_handler
+    api_handler = uhttpd.api_handler.Handler([
+        (['test', 'publish'], {
+            'post': lambda api_request: {
+                'id': hub.publish(api_request['body'], api_request['query_params'].get('event')),
+                'subscribers': hub.subscriber_count()
+            }
+        }),
+        (['test', 'items', '{name}'], {
+            'get': lambda api_request: {'name': api_request['params']['name'], 'context': api_request['context']}
+        }),
+        (['test', 'async'], {'get': make_async_get(True)}),
+        (['test', 'sleep'], TestAsyncAPIHandler()),
+        (['test', 'cached'], TestCountingAPIHandler(), 60),
+        (['test'], TestAPIHandler())
+    ])
+    stream_api_handler = uhttpd.api_handler.Handler([
+        (['cached', 'large'], {'get': lambda api_request: TestAPIHandler().get({'context': ['large']})}, 60),
+        (['cached'], TestCountingAPIHandler(), 60),
+        (['test'], TestAPIHandler())
+    ], stream_json=True, chunk_size=128)
+    import uhttpd.metrics
+    metrics = uhttpd.metrics.Metrics()
     global server
     server = uhttpd.Server([
+        ('/metrics', uhttpd.metrics.Handler(metrics)),
         ('/api', api_handler),
+        ('/events', uhttpd.sse.Handler(hub, keepalive=1)),
+        ('/ws', uhttpd.websocket.Handler(websocket_echo, max_message_size=16 * 1024, timeout=5)),
+        ('/stream', stream_api_handler),
+        ('/body', TestBodyHandler()),
+        ('/upload', upload_handler),
+        ('/bundle', bundle_handler),
+        ('/frozen', frozen_handler),
         ('/test', file_handler)
     ], {
         'port': port,
         'require_auth': True,
-        'backlog': backlog
+        'password': uhttpd.auth.hash_password("uhttpD"),
+        'session_ttl': 60,
+        'backlog': backlog,
+        'max_connections': 4,
+        'max_queued_connections': 2,
+        'queue_timeout': 2,
+        'header_timeout': 2,
+        'body_timeout': 2,
+        'metrics': metrics
     })
     server.run()
 
@@ -26,6 +26,8 @@
 import sys
 import logging
 import gc
+import array
+import utime
 import uasyncio as asyncio
 
 VERSION = "master"
@@ -43,23 +45,242 @@ class ForbiddenException(Exception):
     pass
 
 
+class RequestTimeoutException(Exception):
+    pass
+
+
+VERBS = (
+    (b'GET ', 'get'),
+    (b'PUT ', 'put'),
+    (b'POST ', 'post'),
+    (b'DELETE ', 'delete'),
+    (b'HEAD ', 'head'),
+    (b'OPTIONS ', 'options')
+)
+
+
+GeneratorType = type((lambda: (yield))())
+
+
+REASONS = {
+    101: "Switching Protocols",
+    200: "OK",
+    201: "Created",
+    204: "No Content",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    408: "Request Timeout",
+    416: "Range Not Satisfiable",
+    426: "Upgrade Required",
+    500: "Internal Server Error",
+    503: "Service Unavailable"
+}
+
+STATUS_LINES = {
+    code: "HTTP/1.1 {} {}\r\n".format(code, reason).encode() for code, reason in REASONS.items()
+}
+
+#
+# The Server header, which is the last header of every response, followed
+# by the blank line that ends the headers
+#
+SERVER_HEADER = "Server: uhttpd/{} (running in your devices)\r\n\r\n".format(VERSION).encode()
+
+HEADER_NAMES = {
+    name: "{}: ".format(name).encode() for name in (
+        'content-type', 'content-length', 'transfer-encoding', 'connection',
+        'keep-alive', 'etag', 'last-modified', 'cache-control', 'content-encoding',
+        'vary', 'accept-ranges', 'content-range', 'www-authenticate', 'retry-after'
+    )
+}
+
+HEADER_VALUES = {
+    value: value.encode() for value in (
+        'close', 'keep-alive', 'chunked', 'text/html', 'text/plain', 'text/css',
+        'text/javascript', 'application/json', 'bytes', 'gzip', 'accept-encoding'
+    )
+}
+
+
+def read_within(coro, timeout):
+    #
+    # Runs a read from a connection, raising a RequestTimeoutException if it
+    # does not complete within timeout seconds.  A timeout of None (or 0)
+    # means no timeout.
+    #
+    if not timeout:
+        return (yield from coro)
+    try:
+        return (yield from asyncio.wait_for(coro, timeout))
+    except asyncio.TimeoutError:
+        raise RequestTimeoutException("Timed out reading request")
+
+
 def get_relative_path(http_request):
     path = http_request['path']
     prefix = http_request['prefix']
     return path[len(prefix):]
 
 
+class Headers:
+    #
+    # A dictionary-like view of the HTTP headers of a request, keyed by
+    # lower case header name.  Header lines are copied into a fixed size
+    # buffer, and only the offsets of the name and value in each line are
+    # recorded.  Values are decoded (and cached) when they are looked up.
+    #
+    def __init__(self, size, max_headers):
+        self._buf = bytearray(size)
+        self._mv = memoryview(self._buf)
+        self._max_headers = max_headers
+        self._offsets = array.array('H', [0] * (4 * max_headers))
+        self.clear()
+
+    def clear(self):
+        self._size = 0
+        self._count = 0
+        self._values = None
+
+    def add(self, line):
+        if self._count == self._max_headers:
+            raise BadRequestException("Number of headers exceeds maximum allowable")
+        n = len(line)
+        start = self._size
+        if start + n > len(self._buf):
+            raise BadRequestException("Size of headers exceeds maximum allowable")
+        colon = line.find(b':')
+        if colon < 1:
+            raise BadRequestException("Malformed header")
+        self._buf[start:start + n] = line
+        i = colon + 1
+        while i < n and line[i] <= 32:
+            i += 1
+        while n > i and line[n - 1] <= 32:
+            n -= 1
+        j = self._count * 4
+        offsets = self._offsets
+        offsets[j] = start
+        offsets[j + 1] = start + colon
+        offsets[j + 2] = start + i
+        offsets[j + 3] = start + n
+        self._size = start + len(line)
+        self._count += 1
+
+    def find(self, name):
+        n = len(name)
+        buf = self._buf
+        offsets = self._offsets
+        for i in range(0, self._count * 4, 4):
+            start = offsets[i]
+            if offsets[i + 1] - start != n:
+                continue
+            k = 0
+            while k < n:
+                c = buf[start + k]
+                if 65 <= c <= 90:
+                    c += 32
+                if c != name[k]:
+                    break
+                k += 1
+            if k == n:
+                return i
+        return -1
+
+    def get(self, key, default=None):
+        values = self._values
+        if values is not None and key in values:
+            return values[key]
+        i = self.find(key.encode())
+        if i < 0:
+            return default
+        offsets = self._offsets
+        value = str(self._mv[offsets[i + 2]:offsets[i + 3]], 'UTF-8')
+        if values is None:
+            values = self._values = {}
+        values[key] = value
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.find(key.encode()) >= 0
+
+    def __len__(self):
+        return self._count
+
+    def keys(self):
+        offsets = self._offsets
+        for i in range(0, self._count * 4, 4):
+            yield str(self._mv[offsets[i]:offsets[i + 1]], 'UTF-8').lower()
+
+    def __iter__(self):
+        return self.keys()
+
+    def items(self):
+        for k in self.keys():
+            yield k, self.get(k)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
 class Server:
     def __init__(self, handlers, config={}):
+        import uhttpd.router
         self._handlers = handlers
+        self._router = uhttpd.router.PrefixRouter(handlers)
         self._config = self.update(self.default_config(), config)
+        config = self._config
         self._tcp_server = TCPServer(
-            bind_addr=self._config['bind_addr'],
-            port=self._config['port'],
-            #timeout=self._config['timeout'],
+            bind_addr=config['bind_addr'],
+            port=config['port'],
             handler=self,
-            backlog=self._config['backlog']
+            backlog=config['backlog'],
+            max_connections=config['max_connections'],
+            max_connections_per_client=config['max_connections_per_client'],
+            max_queued_connections=config['max_queued_connections'],
+            queue_timeout=config['queue_timeout'],
+            queue_poll_ms=config['queue_poll_ms'],
+            output_buffer_size=config['output_buffer_size'],
+            gc_policy=config['gc_policy'],
+            busy_response="HTTP/1.1 503 Service Unavailable\r\n"
+                          "retry-after: {}\r\n"
+                          "content-length: 0\r\n"
+                          "connection: close\r\n\r\n".format(config['retry_after']).encode()
         )
+        self._stats = self._tcp_server.stats()
+        self._stats.update({
+            'new_connections': 0,
+            'reused_connections': 0,
+            'parse_alloc': 0,
+            'header_timeouts': 0,
+            'body_timeouts': 0,
+            'idle_timeouts': 0
+        })
+        self._keep_alive_value = "timeout={}, max={}".format(
+            config['keepalive_timeout'], config['max_requests_per_connection']
+        ).encode()
+        self._metrics = config['metrics']
+        if self._metrics:
+            self._metrics.set_stats(self._stats)
+        self._auth = None
+        if config['require_auth']:
+            import uhttpd.auth
+            self._auth = uhttpd.auth.Authenticator(
+                config['user'], config['password'],
+                cache_size=config['auth_cache_size'],
+                cache_ttl=config['auth_cache_ttl'],
+                session_ttl=config['session_ttl'],
+                session_secret=config['session_secret']
+            )
 
     #
     # API
@@ -69,6 +290,16 @@ class Server:
         logging.info("uhttpd-{} running...".format(VERSION))
         self._tcp_server.run()
 
+    def set_password(self, password):
+        #
+        # Changes the password (plaintext, or hashed with
+        # uhttpd.auth.hash_password), invalidating cached credentials and
+        # sessions
+        #
+        self._config['password'] = password
+        if self._auth:
+            self._auth.set_password(password)
+
     #
     # Callbacks
     #
@@ -77,12 +308,73 @@ class Server:
         http_request = {
             'tcp': tcp_request
         }
+        metrics = self._metrics
+        if not metrics:
+            return (yield from self.process_request(reader, writer, http_request, None))
+        #
+        # Count the bytes read and written, and mark the times at which the
+        # request was received, parsed, and handled.
+        #
+        metered = tcp_request.get('metered')
+        if metered is None:
+            import uhttpd.metrics
+            metered = (
+                uhttpd.metrics.MeteredReader(reader),
+                uhttpd.metrics.MeteredWriter(writer),
+                [0, 0, 0]
+            )
+            tcp_request['metered'] = metered
+        metered_reader, metered_writer, marks = metered
+        metered_reader.count = 0
+        metered_writer.reset()
+        marks[0] = marks[1] = marks[2] = 0
+        ret = yield from self.process_request(metered_reader, metered_writer, http_request, marks)
+        start, parsed, handled = marks
+        if start:
+            end = utime.ticks_us()
+            if not parsed:
+                parsed = end
+            if not handled:
+                handled = parsed
+            metrics.observe(
+                http_request.get('prefix', ''),
+                metered_writer.code,
+                utime.ticks_diff(parsed, start),
+                utime.ticks_diff(handled, parsed),
+                utime.ticks_diff(end, handled),
+                metered_reader.count,
+                metered_writer.count
+            )
+        return ret
+
+    def process_request(self, reader, writer, http_request, marks):
+        tcp_request = http_request['tcp']
+        #
+        # Whether the request (other than a streamed body) has been read in
+        # full, so that the next request on the connection can be found
+        # after an error response
+        #
+        complete = False
         try:
             #
-            # parse out the heading line, to get the verb, path, and protocol
+            # parse out the heading line, to get the verb, path, and protocol.
+            # If the client closed the connection (or let a persistent
+            # connection go idle) before sending a request, we are done.
             #
-            line = yield from reader.readline()
-            heading = self.parse_heading(line.decode('UTF-8'))
+            line = yield from self.read_request_line(reader, tcp_request)
+            if not line:
+                return (True, None)
+            if marks:
+                marks[0] = utime.ticks_us()
+            if tcp_request['requests'] > 0:
+                self._stats['reused_connections'] += 1
+            else:
+                self._stats['new_connections'] += 1
+            tcp_request['requests'] += 1
+            track_alloc = self._config['track_alloc']
+            if track_alloc:
+                alloc = gc.mem_alloc()
+            heading = self.parse_heading(line)
             #logging.debug("Parsed heading {}".format(heading))
             http_request.update(heading)
             #
@@ -92,41 +384,71 @@ class Server:
             #
             path = http_request['path']
             handler = None
-            for prefix, h in self._handlers:
-                if path.startswith(prefix):
-                    http_request['prefix'] = prefix
-                    handler = h
-                    #logging.debug("Found handler for prefix {}".format(prefix))
-                    break
+            route = self._router.find(path)
+            if route:
+                _index, http_request['prefix'], handler = route
+                #logging.debug("Found handler for prefix {}".format(http_request['prefix']))
             #
-            # Parse out the headers
+            # Parse out the headers.  The header lines are copied into a
+            # buffer that is reused for every request on this connection,
+            # and are only decoded when a handler looks them up.
             #
-            headers = {}
-            num_headers = 0
-            while True:
-                line = yield from reader.readline()
-                if not line or line == b'\r\n':
-                    break
-                k, v = Server.parse_header(line.decode('UTF-8'))
-                headers[k.lower()] = v
-                num_headers += 1
-                if num_headers > self._config['max_headers']:
-                    raise BadRequestException("Number of headers exceeds maximum allowable")
+            headers = tcp_request.get('header_buffer')
+            if headers is None:
+                headers = Headers(self._config['max_header_size'], self._config['max_headers'])
+                tcp_request['header_buffer'] = headers
+            else:
+                headers.clear()
+            yield from read_within(
+                self.read_headers(reader, headers), self._config['header_timeout']
+            )
             #logging.debug("Parsed headers {}".format(headers))
             http_request['headers'] = headers
+            if track_alloc:
+                alloc = gc.mem_alloc() - alloc
+                http_request['parse_alloc'] = alloc
+                self._stats['parse_alloc'] += alloc
+            #
+            # If the headers have a content length, then read the body.
             #
-            # If the headers have a content length, then read the body
+            # If the handler streams request bodies, it gets a reader from
+            # which it can read the body as it needs it, limited only by the
+            # handler's max_body_length, if it has one.  Otherwise, the body
+            # is read here, subject to max_content_length.  A body sent
+            # using the chunked transfer coding is decoded as it is read.
             #
-            #content_length = 0
-            if 'content-length' in headers:
-                content_length = int(headers['content-length'])
+            body_timeout = self._config['body_timeout']
+            stream_body = handler and getattr(handler, 'stream_body', False)
+            max_length = getattr(handler, 'max_body_length', None) if stream_body \
+                else self._config['max_content_length']
+            transfer_encoding = headers.get('transfer-encoding')
+            if transfer_encoding and 'chunked' in transfer_encoding.lower():
+                body_reader = ChunkedReader(reader, max_length, body_timeout)
+                if stream_body:
+                    http_request['body_reader'] = body_reader
+                else:
+                    body = yield from body_reader.read()
+                    if body:
+                        http_request['body'] = body
+            elif 'content-length' in headers:
+                content_length = headers['content-length'].strip()
+                if not content_length.isdigit():
+                    raise BadRequestException("Invalid content-length: {}".format(content_length))
+                content_length = int(content_length)
                 #logging.debug("content_length: {}".format(content_length))
-                if content_length > self._config['max_content_length']:
+                if max_length is not None and content_length > max_length:
                     raise BadRequestException("Content size exceeds maximum allowable")
+                elif stream_body:
+                    http_request['body_reader'] = LengthReader(reader, content_length, body_timeout)
                 elif content_length > 0:
-                    body = yield from reader.read(content_length)
+                    body = yield from read_within(
+                        Server.read_exactly(reader, content_length), body_timeout
+                    )
                     #logging.debug("Read body: {}".format(body))
                     http_request['body'] = body
+            complete = True
+            if marks:
+                marks[1] = utime.ticks_us()
             #
             # If there is no handler, then raise a NotFound exception
             #
@@ -134,41 +456,178 @@ class Server:
                 raise NotFoundException("No Handler for path {}".format(path))
             #
             # Authenticate the user, if configured to do so.  If required
-            # and there is no authorization header, reply with a 401 and
-            # specify the basic auth realm.  Otherwise, try to validate the
-            # supplied credentials.  Audit either case.
+            # and there are no (valid) credentials, reply with a 401 and
+            # specify the basic auth realm.  Audit failures, and successes
+            # for which the credentials had to be verified (rather than
+            # found in the cache, or in a session cookie).
             #
-            if self._config['require_auth']:
-                if not 'authorization' in headers:
-                    return (yield from self.unauthorized_error(writer))
-                else:
-                    remote_addr = tcp_request['remote_addr']
-                    is_authorized, user = self.is_authorized(headers['authorization'])
-                    if not is_authorized:
-                        logging.info("UNAUTHORIZED {}".format(remote_addr))
-                        return (yield from self.unauthorized_error(writer))
-                    else:
-                        logging.info("AUTHORIZED {}".format(remote_addr))
-                        http_request['user'] = user
+            session_cookie = None
+            if self._auth:
+                user, verified, session_cookie = self._auth.authenticate(headers)
+                if user is None:
+                    if 'authorization' in headers:
+                        logging.info("UNAUTHORIZED {}".format(tcp_request['remote_addr']))
+                    return (yield from self.send_error(writer, http_request, self.unauthorized_error(), complete))
+                if verified:
+                    logging.info("AUTHORIZED {}".format(tcp_request['remote_addr']))
+                http_request['user'] = user
             #
             # get the response from the active handler and serialize it
             # to the socket
             #
             response = handler.handle_request(http_request)
-            return (yield from Server.response(writer, response))
+            if type(response) is GeneratorType:
+                response = yield from response
+            if marks:
+                marks[2] = utime.ticks_us()
+            if session_cookie:
+                response['headers']['set-cookie'] = session_cookie
+            self.add_transfer_encoding(http_request, response)
+            keep_alive = self.is_keep_alive(http_request, response)
+            self.add_connection_headers(response, keep_alive)
         except BadRequestException as e:
-            return (yield from Server.bad_request_error(writer, e))
+            return (yield from self.send_error(writer, http_request, Server.bad_request_error(e), complete))
+        except RequestTimeoutException as e:
+            self._stats['body_timeouts' if 'headers' in http_request else 'header_timeouts'] += 1
+            return (yield from self.send_error(writer, http_request, Server.request_timeout_error(e), complete))
         except ForbiddenException as e:
-            return (yield from Server.forbidden_error(writer, e))
+            return (yield from self.send_error(writer, http_request, Server.forbidden_error(e), complete))
         except NotFoundException as e:
-            return (yield from Server.not_found_error(writer, e))
+            return (yield from self.send_error(writer, http_request, Server.not_found_error(e), complete))
         except BaseException as e:
-            return (yield from Server.internal_server_error(writer, e))
+            return (yield from self.send_error(writer, http_request, Server.internal_server_error(e), complete))
+        #
+        # Once the response has started, it is too late to send an error
+        # response instead, so a failure writing it just closes the connection
+        #
+        ret = yield from Server.response(writer, response, keep_alive)
+        #
+        # If the handler upgraded the connection to another protocol, it
+        # takes over the connection, which is closed once it is done.
+        #
+        upgrade = response.get('upgrade')
+        if upgrade:
+            yield from upgrade(reader, writer)
+            return (True, None)
+        return ret
+
+    def stats(self):
+        return self._stats
 
     #
     # Internal operations
     #
 
+    def read_request_line(self, reader, tcp_request):
+        #
+        # A new connection gets at most header_timeout seconds to send its
+        # request line, and a client holding a persistent connection open
+        # gets at most keepalive_timeout seconds to start its next request.
+        # Either way, there is nothing to respond to, so the connection is
+        # just closed.
+        #
+        if tcp_request['requests'] == 0:
+            timeout, counter = self._config['header_timeout'], 'header_timeouts'
+        else:
+            timeout, counter = self._config['keepalive_timeout'], 'idle_timeouts'
+        if not timeout:
+            return (yield from reader.readline())
+        try:
+            return (yield from asyncio.wait_for(reader.readline(), timeout))
+        except asyncio.TimeoutError:
+            self._stats[counter] += 1
+            return None
+
+    @staticmethod
+    def read_headers(reader, headers):
+        while True:
+            line = yield from reader.readline()
+            if not line or line == b'\r\n':
+                break
+            headers.add(line)
+
+    @staticmethod
+    def read_exactly(reader, n):
+        #
+        # StreamReader.read may return fewer bytes than requested, and any
+        # bytes left unread would be taken as the start of the next
+        # (pipelined) request on a persistent connection.
+        #
+        data = yield from reader.read(n)
+        if len(data) == n:
+            return data
+        buf = bytearray(data)
+        while len(buf) < n:
+            data = yield from reader.read(n - len(buf))
+            if not data:
+                raise BadRequestException("Connection closed before end of body")
+            buf.extend(data)
+        return bytes(buf)
+
+    @staticmethod
+    def add_transfer_encoding(http_request, response):
+        #
+        # A body of unknown length is sent chunked to HTTP/1.1 clients, so
+        # that the connection can be kept open.  HTTP/1.0 clients do not
+        # understand chunks, so the end of the body is marked by closing
+        # the connection.
+        #
+        headers = response['headers']
+        if response.get('body') and http_request['protocol'] == 'HTTP/1.1' \
+                and 'content-length' not in headers and 'transfer-encoding' not in headers:
+            headers['transfer-encoding'] = 'chunked'
+
+    def is_keep_alive(self, http_request, response):
+        config = self._config
+        if not config['keepalive']:
+            return False
+        #
+        # If the handler did not read all of a streamed request body, the
+        # rest of it is still on the connection, ahead of the next request.
+        #
+        body_reader = http_request.get('body_reader')
+        if body_reader and not body_reader.eof():
+            return False
+        if 'upgrade' in response:
+            return False
+        if http_request['tcp']['requests'] >= config['max_requests_per_connection']:
+            return False
+        #
+        # Don't let an idle persistent connection hold a connection slot
+        # while other clients are waiting for one.
+        #
+        if self._tcp_server.has_queued_connections():
+            return False
+        #
+        # The client can only tell where the response ends if it has a
+        # content-length, is chunked, or has no body at all.
+        #
+        headers = response['headers']
+        if response.get('body') and 'content-length' not in headers \
+                and headers.get('transfer-encoding') != 'chunked':
+            return False
+        connection = http_request['headers'].get('connection', '').lower()
+        if http_request['protocol'] == 'HTTP/1.1':
+            return 'close' not in connection
+        else:
+            return 'keep-alive' in connection
+
+    def add_connection_headers(self, response, keep_alive):
+        #
+        # Upgrade responses carry their own connection header, and no body
+        #
+        if 'upgrade' in response:
+            return
+        headers = response['headers']
+        if not response.get('body') and 'content-length' not in headers \
+                and response['code'] not in (204, 304):
+            headers['content-length'] = 0
+        if keep_alive:
+            headers['connection'] = 'keep-alive'
+            headers['keep-alive'] = self._keep_alive_value
+        else:
+            headers['connection'] = 'close'
+
     @staticmethod
     def update(a, b):
         a.update(b)
@@ -179,14 +638,33 @@ class Server:
         return {
             'bind_addr': '0.0.0.0',
             'port': 80,
-            #'timeout': 30,
             'require_auth': False,
             'realm': "esp8266",
             'user': "admin",
             'password': "uhttpD",
+            'auth_cache_size': 4,
+            'auth_cache_ttl': 300,
+            'session_ttl': None,
+            'session_secret': None,
             'max_headers': 25,
+            'max_header_size': 2048,
             'max_content_length': 1024,
-            'backlog': 5
+            'backlog': 5,
+            'keepalive': True,
+            'keepalive_timeout': 5,
+            'max_requests_per_connection': 100,
+            'track_alloc': False,
+            'max_connections': 4,
+            'max_connections_per_client': None,
+            'max_queued_connections': 8,
+            'queue_timeout': 10,
+            'queue_poll_ms': 50,
+            'retry_after': 5,
+            'header_timeout': 10,
+            'body_timeout': 10,
+            'metrics': None,
+            'output_buffer_size': 1460,
+            'gc_policy': None
         }
 
     #def readline(self, client_socket):
@@ -194,133 +672,157 @@ class Server:
 
     @staticmethod
     def parse_heading(line):
-        ra = line.split()
-        try:
-            return {
-                'verb': ra[0].lower(),
-                'path': ra[1],
-                'protocol': ra[2]
-            }
-        except:
+        #
+        # The verb and protocol are matched against constants in place;
+        # only the path needs to be decoded.
+        #
+        sp1 = line.find(b' ')
+        sp2 = line.find(b' ', sp1 + 1)
+        if sp1 < 1 or sp2 < 0:
             raise BadRequestException("Error splitting parsing heading into verb path protocol")
-
-    @staticmethod
-    def parse_header(line):
-        ra = line.split(":")
-        return (ra[0].strip(), ra[1].strip())
-
-    def is_authorized(self, authorization):
-        import ubinascii
-        try:
-            tmp = authorization.split()
-            if tmp[0].lower() == "basic":
-                str = ubinascii.a2b_base64(tmp[1].strip().encode()).decode()
-                ra = str.split(':')
-                auth_result = ra[0] == self._config['user'] and ra[1] == self._config['password']
-                return auth_result, ra[0]
-            else:
-                raise BadRequestException(
-                    "Unsupported authorization method: {}".format(tmp[0]))
-        except Exception as e:
-            raise BadRequestException(e)
-
-    @staticmethod
-    def server_name():
-        return "uhttpd/{} (running in your devices)".format(VERSION)
-
-    @staticmethod
-    def format_heading(code):
-        return "HTTP/1.1 {} {}".format(code, Server.lookup_code(code))
-
-    @staticmethod
-    def lookup_code(code):
-        if code == 200:
-            return "OK"
-        elif code == 400:
-            return "Bad Request"
-        elif code == 401:
-            return "Unauthorized"
-        elif code == 403:
-            return "Forbidden"
-        elif code == 404:
-            return "Not Found"
-        elif code == 500:
-            return "Internal Server Error"
+        verb = None
+        for prefix, v in VERBS:
+            if line.startswith(prefix):
+                verb = v
+                break
+        if verb is None:
+            verb = line[:sp1].decode('UTF-8').lower()
+        if line.startswith(b'HTTP/1.1', sp2 + 1):
+            protocol = 'HTTP/1.1'
+        elif line.startswith(b'HTTP/1.0', sp2 + 1):
+            protocol = 'HTTP/1.0'
         else:
-            return "Unknown"
+            protocol = line[sp2 + 1:].decode('UTF-8').strip()
+        return {
+            'verb': verb,
+            'path': line[sp1 + 1:sp2].decode('UTF-8'),
+            'protocol': protocol
+        }
 
     @staticmethod
-    def format_headers(headers):
-        ret = ""
-        for k, v in headers.items():
-            ret += "{}: {}\r\n".format(k, v)
-        return ret
+    def lookup_code(code):
+        return REASONS.get(code, "Unknown")
 
     @staticmethod
-    def response(client_socket, response):
+    def response(client_socket, response, keep_alive=False):
         yield from Server.serialize(client_socket, response)
-        return (True, None)
+        yield from client_socket.flush()
+        return (not keep_alive, None)
 
     @staticmethod
     def serialize(stream, response):
         #
-        # write the heading and headers
+        # Write the status line and headers.  These are copied into a pooled
+        # buffer, using precomputed bytes for the status line, the Server
+        # header, and common header names and values, and sent in a single
+        # write (or more, if they do not fit in the buffer).
         #
-        yield from stream.awrite("{}\r\n{}\r\n".format(
-            Server.format_heading(response['code']),
-            Server.format_headers(Server.update(
-                response['headers'], {'Server': Server.server_name()}
-            ))
-        ).encode('UTF-8'))
+        code = response['code']
+        status_line = STATUS_LINES.get(code)
+        if status_line is None:
+            status_line = "HTTP/1.1 {} Unknown\r\n".format(code).encode()
+        buf = HEADER_BUFFERS.acquire()
+        try:
+            size = len(buf)
+            n = len(status_line)
+            buf[0:n] = status_line
+            for name, value in response['headers'].items():
+                data = HEADER_NAMES.get(name)
+                if data is None:
+                    data = "{}: ".format(name).encode()
+                if type(value) is bytes:
+                    encoded = value
+                else:
+                    encoded = HEADER_VALUES.get(value)
+                    if encoded is None:
+                        encoded = str(value).encode()
+                m = len(data) + len(encoded) + 2
+                if n + m > size:
+                    yield from stream.awrite(buf, 0, n)
+                    n = 0
+                    if m > size:
+                        yield from stream.awrite(data + encoded + b'\r\n')
+                        continue
+                buf[n:n + len(data)] = data
+                n += len(data)
+                buf[n:n + len(encoded)] = encoded
+                n += len(encoded)
+                buf[n:n + 2] = b'\r\n'
+                n += 2
+            m = len(SERVER_HEADER)
+            if n + m > size:
+                yield from stream.awrite(buf, 0, n)
+                n = 0
+            buf[n:n + m] = SERVER_HEADER
+            n += m
+            yield from stream.awrite(buf, 0, n)
+        finally:
+            HEADER_BUFFERS.release(buf)
         #
-        # Write the body, if it's present
+        # Write the body, if it's present.  If the response is chunked, the
+        # body is written through a ChunkedWriter, which frames each write
+        # as a chunk.
         #
         if 'body' in response:
             body = response['body']
             if body:
-                yield from body(stream)
+                if response['headers'].get('transfer-encoding') == 'chunked':
+                    writer = ChunkedWriter(stream)
+                    yield from body(writer)
+                    yield from writer.finish()
+                else:
+                    yield from body(stream)
 
-    def unauthorized_error(self, writer):
+    def send_error(self, writer, http_request, response, complete):
+        #
+        # The connection is kept open after an error response, as after any
+        # other response, but only if the request was read in full.  If it
+        # could not be parsed, or its body was not (entirely) read, there is
+        # no telling where the next request starts, so the connection is
+        # closed.
+        #
+        keep_alive = complete and self.is_keep_alive(http_request, response)
+        self.add_connection_headers(response, keep_alive)
+        return (yield from Server.response(writer, response, keep_alive))
+
+    def unauthorized_error(self):
         headers = {
             'www-authenticate': "Basic realm={}".format(self._config['realm'])
         }
-        return Server.error(writer, 401, "Unauthorized", None, headers)
+        return Server.error(401, "Unauthorized", None, headers)
 
     @staticmethod
-    def bad_request_error(writer, e):
+    def bad_request_error(e):
         error_message = "Bad Request {}:".format(e)
-        return (yield from Server.error(writer, 400, error_message, e))
+        return Server.error(400, error_message, e)
 
     @staticmethod
-    def forbidden_error(writer, e):
+    def request_timeout_error(e):
+        error_message = "Request Timeout {}:".format(e)
+        return Server.error(408, error_message, e)
+
+    @staticmethod
+    def forbidden_error(e):
         error_message = "Forbidden {}:".format(e)
-        return (yield from Server.error(writer, 403, error_message, e))
+        return Server.error(403, error_message, e)
 
     @staticmethod
-    def not_found_error(writer, e):
+    def not_found_error(e):
         error_message = "Not Found: {}".format(e)
-        return (yield from Server.error(writer, 404, error_message, e))
+        return Server.error(404, error_message, e)
 
     @staticmethod
-    def internal_server_error(writer, e):
+    def internal_server_error(e):
         sys.print_exception(e)
         error_message = "Internal Server Error: {}".format(e)
-        return (yield from Server.error(writer, 500, error_message, e))
+        return Server.error(500, error_message, e)
 
     @staticmethod
-    def error(writer, code, error_message, e, headers={}):
+    def error(code, error_message, e, headers={}):
         #logging.debug("Error!  code: {} error_message: {} exception: {}".format(code, error_message, e))
-        ef = lambda stream: (yield from Server.stream_error(writer, error_message, e))
-        response = Server.generate_error_response(code, ef, headers)
-        return (yield from Server.response(writer, response))
-
-    @staticmethod
-    def stream_error(writer, error_message, e):
-        yield from writer.awrite(error_message)
         if e:
-            yield from writer.awrite('<pre>')
-            yield from writer.awrite(Server.stacktrace(e))
-            yield from writer.awrite('</pre>')
+            error_message = "{}<pre>{}</pre>".format(error_message, Server.stacktrace(e).decode('UTF-8'))
+        return Server.generate_error_response(code, error_message, headers)
 
     @staticmethod
     def stacktrace(e):
@@ -330,61 +832,409 @@ class Server:
         return buf.getvalue()
 
     @staticmethod
-    def generate_error_response(code, ef, headers={}):
-        data1 = '<html><body><header>uhttpd/{}<hr></header>'.format(
-            VERSION).encode('UTF-8')
-        # message data in ef will go here
-        data2 = '</body></html>'.encode('UTF-8')
-        body = lambda writer: (yield from Server.write_html(writer, data1, ef, data2))
+    def generate_error_response(code, error_message, headers={}):
+        #
+        # The body is rendered up front, so that the response has a
+        # content-length, and the connection may be kept open
+        #
+        data = '<html><body><header>uhttpd/{}<hr></header>{}</body></html>'.format(
+            VERSION, error_message).encode('UTF-8')
         return {
             'code': code,
             'headers': Server.update({
                 'content-type': "text/html",
+                'content-length': len(data)
             }, headers),
-            'body': body
+            'body': lambda stream: stream.awrite(data)
         }
 
-    @staticmethod
-    def write_html(writer, data1, ef, data2):
-        yield from writer.awrite(data1)
-        yield from ef(writer)
-        yield from writer.awrite(data2)
+
+class BufferPool:
+    #
+    # A pool of reusable buffers of (at most) size bytes, so that buffers
+    # used to send responses are not reallocated for each response.  A
+    # buffer is acquired for the duration of a response and released when
+    # the response is done; at most max_free released buffers are kept.
+    # If a buffer of the requested size cannot be allocated, buffers of
+    # half the size are tried, until an allocation succeeds.
+    #
+    def __init__(self, size, max_free=2):
+        self._size = size
+        self._max_free = max_free
+        self._free = []
+
+    def acquire(self):
+        if self._free:
+            return self._free.pop()
+        size = self._size
+        while True:
+            if size < 1:
+                raise Exception("Unable to allocate buffer")
+            try:
+                return bytearray(size)
+            except MemoryError:
+                size //= 2
+
+    def release(self, buf):
+        if len(self._free) < self._max_free:
+            self._free.append(buf)
+
+
+#
+# The buffers into which response status lines and headers are written
+#
+HEADER_BUFFERS = BufferPool(512)
+
+
+class LengthReader:
+    #
+    # Wraps a stream reader, reading a request body of a known length.  The
+    # read operation has the same semantics as ChunkedReader.read.
+    #
+    def __init__(self, reader, length, timeout=None):
+        self._reader = reader
+        self._remaining = length
+        self._timeout = timeout
+
+    def eof(self):
+        return self._remaining == 0
+
+    def read(self, n=-1):
+        if n < 0:
+            n = self._remaining
+        if self._remaining == 0:
+            return b''
+        if n == self._remaining:
+            data = yield from read_within(Server.read_exactly(self._reader, n), self._timeout)
+        else:
+            data = yield from read_within(self._reader.read(min(n, self._remaining)), self._timeout)
+            if not data:
+                raise BadRequestException("Connection closed before end of body")
+        self._remaining -= len(data)
+        return data
+
+
+class ChunkedReader:
+    #
+    # Wraps a stream reader, decoding a request body sent using the HTTP/1.1
+    # chunked transfer coding.  Each call to read returns at most n bytes of
+    # decoded data (or all remaining data, if n is -1), and an empty bytes
+    # object at the end of the body.  Data is only read off the connection
+    # as the caller asks for it.  If max_length is not None, a body longer
+    # than max_length bytes is a bad request.  Each read from the connection
+    # must complete within timeout seconds, unless timeout is None.
+    #
+    def __init__(self, reader, max_length, timeout=None):
+        self._reader = reader
+        self._max_length = max_length
+        self._timeout = timeout
+        self._length = 0
+        self._remaining = 0
+        self._eof = False
+
+    def eof(self):
+        return self._eof
+
+    def read(self, n=-1):
+        if n < 0:
+            buf = bytearray()
+            while True:
+                data = yield from self.read(1024)
+                if not data:
+                    return bytes(buf)
+                buf.extend(data)
+        if self._eof:
+            return b''
+        if self._remaining == 0:
+            yield from self.read_chunk_size()
+            if self._eof:
+                return b''
+        data = yield from read_within(self._reader.read(min(n, self._remaining)), self._timeout)
+        if not data:
+            raise BadRequestException("Connection closed before end of body")
+        self._remaining -= len(data)
+        if self._remaining == 0:
+            yield from read_within(self._reader.readline(), self._timeout)
+        return data
+
+    def read_chunk_size(self):
+        line = yield from read_within(self._reader.readline(), self._timeout)
+        try:
+            i = line.find(b';')
+            size = int(line[:i] if i >= 0 else line, 16)
+        except ValueError:
+            raise BadRequestException("Malformed chunk size")
+        if size == 0:
+            #
+            # skip any trailers, up to the blank line ending the body
+            #
+            while True:
+                line = yield from read_within(self._reader.readline(), self._timeout)
+                if not line or line == b'\r\n':
+                    break
+            self._eof = True
+            return
+        self._length += size
+        if self._max_length is not None and self._length > self._max_length:
+            raise BadRequestException("Content size exceeds maximum allowable")
+        self._remaining = size
+
+
+class ChunkedWriter:
+    #
+    # Wraps a stream, writing the data passed to each awrite as a chunk,
+    # per the HTTP/1.1 chunked transfer coding.  Call finish to write the
+    # last (empty) chunk.
+    #
+    def __init__(self, stream):
+        self._stream = stream
+
+    def awrite(self, buf, off=0, sz=-1):
+        if type(buf) is str:
+            buf = buf.encode()
+        if sz == -1:
+            sz = len(buf) - off
+        if sz == 0:
+            return
+        yield from self._stream.awrite("{:x}\r\n".format(sz))
+        yield from self._stream.awrite(buf, off, sz)
+        yield from self._stream.awrite(b'\r\n')
+
+    def flush(self):
+        yield from self._stream.flush()
+
+    def finish(self):
+        yield from self._stream.awrite(b'0\r\n\r\n')
+
+
+class BufferedWriter:
+    #
+    # Wraps a stream writer, coalescing writes into a buffer of (up to)
+    # size bytes, so that a response is sent in as few TCP segments as
+    # possible.  The buffer is borrowed from the pool on the first write,
+    # and is written out whenever it fills.  Call flush at the end of a
+    # response (or whenever data must be sent right away) to write out
+    # what is buffered, and return the buffer to the pool.  Writes at least
+    # as large as the buffer are written straight through.  If pool is
+    # None, writes are not buffered.
+    #
+    def __init__(self, writer, pool):
+        self._writer = writer
+        self._pool = pool
+        self._buf = None
+        self._n = 0
+        self.extra = writer.extra
+
+    def awrite(self, buf, off=0, sz=-1):
+        if type(buf) is str:
+            buf = buf.encode()
+        if sz == -1:
+            sz = len(buf) - off
+        out = self._buf
+        if out is None:
+            if self._pool is None:
+                yield from self._writer.awrite(buf, off, sz)
+                return
+            out = self._buf = self._pool.acquire()
+        size = len(out)
+        n = self._n
+        if sz >= size:
+            if n:
+                yield from self._writer.awrite(out, 0, n)
+                self._n = 0
+            yield from self._writer.awrite(buf, off, sz)
+            return
+        if off != 0 or sz != len(buf):
+            buf = memoryview(buf)[off:off + sz]
+        if n + sz <= size:
+            out[n:n + sz] = buf
+            self._n = n + sz
+            return
+        #
+        # Fill the buffer, write it out, and keep the rest
+        #
+        if type(buf) is not memoryview:
+            buf = memoryview(buf)
+        k = size - n
+        out[n:size] = buf[:k]
+        yield from self._writer.awrite(out, 0, size)
+        out[0:sz - k] = buf[k:]
+        self._n = sz - k
+
+    def flush(self):
+        out = self._buf
+        if out is not None:
+            self._buf = None
+            try:
+                if self._n:
+                    yield from self._writer.awrite(out, 0, self._n)
+            finally:
+                self._n = 0
+                self._pool.release(out)
+
+    def discard(self):
+        #
+        # Drop anything buffered, e.g., once the connection has failed
+        #
+        if self._buf is not None:
+            self._pool.release(self._buf)
+            self._buf = None
+            self._n = 0
+
+    def aclose(self):
+        yield from self._writer.aclose()
 
 
 class TCPServer:
+    #
+    # Connections are admitted up to max_connections at a time (and, per
+    # client address, up to max_connections_per_client); None means no
+    # limit.  While the server is saturated, up to max_queued_connections
+    # further connections wait up to queue_timeout seconds for a slot,
+    # checking for one every queue_poll_ms milliseconds.
+    # Any other connection is sent the busy_response (if any) and closed,
+    # before any of its request is read.  Writes to each connection are
+    # coalesced in a buffer of output_buffer_size bytes, unless it is 0.
+    # The gc_policy (see uhttpd.gc_policy) decides when to collect garbage.
+    #
     def __init__(self, port, handler, bind_addr='0.0.0.0',
-                 #timeout=30,
-                 backlog=10):
+                 backlog=10, max_connections=None, max_connections_per_client=None,
+                 max_queued_connections=0, queue_timeout=0, busy_response=None,
+                 output_buffer_size=0, gc_policy=None, queue_poll_ms=50):
         self._port = port
         self._handler = handler
         self._bind_addr = bind_addr
-        #self._timeout = timeout
         self._backlog = backlog
+        self._max_connections = max_connections
+        self._max_connections_per_client = max_connections_per_client
+        self._max_queued_connections = max_queued_connections
+        self._queue_timeout_ms = queue_timeout * 1000
+        self._queue_poll_ms = queue_poll_ms
+        self._busy_response = busy_response
+        #
+        # Buffers in which the output on each connection is coalesced.
+        # Buffers are only held while a response is being written.
+        #
+        self._output_buffers = BufferPool(output_buffer_size) if output_buffer_size else None
+        self._clients = {}
+        self._queued = 0
+        self._stats = {
+            'active_connections': 0,
+            'queued_connections': 0,
+            'rejected_connections': 0
+        }
+        if gc_policy is None:
+            import uhttpd.gc_policy
+            gc_policy = uhttpd.gc_policy.Watermark()
+        gc_policy.install(self._stats)
+        self._gc_policy = gc_policy
+
+    def stats(self):
+        return self._stats
+
+    def has_queued_connections(self):
+        return self._queued > 0
 
     def handle_receive(self, reader, writer, tcp_request):
         try:
             done, response = yield from self._handler.handle_request(reader, writer, tcp_request)
             if response and len(response) > 0:
                 yield from writer.awrite(response)
+                yield from writer.flush()
             if done:
                 return False
             else:
                 return True
+        except OSError:
+            #
+            # The connection failed (e.g., the client went away while a
+            # response was being written), so there is no one to tell
+            #
+            return False
         except Exception as e:
             sys.print_exception(e)
             return False
 
     def serve(self, reader, writer):
+        remote_addr = writer.extra["peername"]
+        client = remote_addr[0] if type(remote_addr) is tuple else remote_addr
+        admitted = yield from self.admit(client)
+        if not admitted:
+            try:
+                if self._busy_response:
+                    yield from writer.awrite(self._busy_response)
+            finally:
+                yield from writer.aclose()
+            return
         tcp_request = {
-            'remote_addr': writer.extra["peername"]
+            'remote_addr': remote_addr,
+            'requests': 0
         }
-        gc.collect()
+        buffered_writer = BufferedWriter(writer, self._output_buffers)
+        gc_policy = self._gc_policy
+        gc_policy.on_connect()
         try:
-            while (yield from self.handle_receive(reader, writer, tcp_request)):
-                gc.collect()
+            while (yield from self.handle_receive(reader, buffered_writer, tcp_request)):
+                gc_policy.on_request()
         finally:
+            buffered_writer.discard()
+            self.release(client)
             yield from writer.aclose()
-            gc.collect()
+            gc_policy.on_close()
+
+    def admit(self, client):
+        stats = self._stats
+        clients = self._clients
+        max_per_client = self._max_connections_per_client
+        if max_per_client is not None and clients.get(client, 0) >= max_per_client:
+            stats['rejected_connections'] += 1
+            return False
+        #
+        # A connection counts against the limit for its client while it is
+        # queued, as well, so that a client cannot fill the queue and then
+        # be admitted more connections than its limit
+        #
+        clients[client] = clients.get(client, 0) + 1
+        max_connections = self._max_connections
+        if max_connections is not None and stats['active_connections'] >= max_connections:
+            if self._queued >= self._max_queued_connections:
+                self.reject(client)
+                return False
+            #
+            # Wait for a connection slot to free up.  A queued connection
+            # only holds its socket; no buffers are allocated for it until
+            # it is admitted.
+            #
+            stats['queued_connections'] += 1
+            self._queued += 1
+            try:
+                waited = 0
+                poll_ms = self._queue_poll_ms
+                while stats['active_connections'] >= max_connections:
+                    if waited >= self._queue_timeout_ms:
+                        self.reject(client)
+                        return False
+                    yield from asyncio.sleep_ms(poll_ms)
+                    waited += poll_ms
+            finally:
+                self._queued -= 1
+        stats['active_connections'] += 1
+        return True
+
+    def reject(self, client):
+        self._stats['rejected_connections'] += 1
+        self.remove_client(client)
+
+    def release(self, client):
+        self._stats['active_connections'] -= 1
+        self.remove_client(client)
+
+    def remove_client(self, client):
+        n = self._clients[client] - 1
+        if n:
+            self._clients[client] = n
+        else:
+            del self._clients[client]
 
     def run(self, debug=False):
         if debug:
@@ -24,12 +24,112 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 import ujson
+import utime
 import uhttpd
+import uhttpd.router
+
+
+def iter_json(obj):
+    #
+    # Generates the JSON encoding of obj, as a sequence of string fragments.
+    # Dictionaries and lists are walked here, so that the full encoding is
+    # never held in memory; scalars (including strings, which need escaping)
+    # are encoded by ujson.
+    #
+    obj_type = type(obj)
+    if obj_type is dict:
+        yield '{'
+        i = 0
+        for k, v in obj.items():
+            if i > 0:
+                yield ', '
+            yield ujson.dumps(k if type(k) is str else str(k))
+            yield ': '
+            yield from iter_json(v)
+            i += 1
+        yield '}'
+    elif obj_type is list or obj_type is tuple:
+        yield '['
+        i = 0
+        for e in obj:
+            if i > 0:
+                yield ', '
+            yield from iter_json(e)
+            i += 1
+        yield ']'
+    else:
+        yield ujson.dumps(obj)
+
+
+class ResponseCache:
+    #
+    # A cache of serialized responses, keyed by request path (including the
+    # query string).  Entries are [expires, data, content_type, last_used]
+    # lists, where expires is in utime.ticks_ms units.  The total size of the
+    # cached keys and data is bounded by max_bytes; when an entry does not
+    # fit, the least recently used entries are evicted.  The cache is
+    # expected to hold a handful of entries, so eviction is a linear scan.
+    #
+    def __init__(self, max_bytes):
+        self._entries = {}
+        self.max_bytes = max_bytes
+        self._bytes = 0
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if utime.ticks_diff(entry[0], now) <= 0:
+            self.remove(key)
+            return None
+        self._clock += 1
+        entry[3] = self._clock
+        return entry
+
+    def put(self, key, expires, data, content_type):
+        self.remove(key)
+        n = len(key) + len(data)
+        if n > self.max_bytes:
+            return
+        entries = self._entries
+        while entries and self._bytes + n > self.max_bytes:
+            lru = None
+            for k, entry in entries.items():
+                if lru is None or entry[3] < entries[lru][3]:
+                    lru = k
+            self.remove(lru)
+        self._clock += 1
+        entries[key] = [expires, data, content_type, self._clock]
+        self._bytes += n
+
+    def remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(key) + len(entry[1])
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self._bytes
+        }
 
 
 class Handler:
-    def __init__(self, handlers):
+    def __init__(self, handlers, stream_json=False, chunk_size=512, cache_size=2048):
         self._handlers = handlers
+        self._router = uhttpd.router.Router(handlers)
+        self._stream_json = stream_json
+        self._chunk_size = chunk_size
+        self._cache = ResponseCache(cache_size)
 
     #
     # callbacks
@@ -39,8 +139,9 @@ class Handler:
         relative_path = uhttpd.get_relative_path(http_request)
         path_part, query_params = self.extract_query(relative_path)
         components = path_part.strip('/').split('/')
-        prefix, handler, context = self.find_handler(components)
-        if handler:
+        route = self._router.find(components)
+        if route:
+            prefix, handler, verbs, context, params, ttl = route
             json_body = None
             headers = http_request['headers']
             if 'body' in http_request and 'content-type' in headers and headers['content-type'] == "application/json":
@@ -52,31 +153,161 @@ class Handler:
             api_request = {
                 'prefix': prefix,
                 'context': context,
+                'params': params,
                 'query_params': query_params,
                 'body': json_body,
                 'http': http_request
             }
-            if verb == 'get':
-                response = handler.get(api_request)
-            elif verb == 'put':
-                response = handler.put(api_request)
-            elif verb == 'post':
-                response = handler.post(api_request)
-            elif verb == 'delete':
-                response = handler.delete(api_request)
-            else:
-                # TODO add support for more verbs!
+            f = verbs.get(verb)
+            if f is None:
                 error_message = "Unsupported verb: {}".format(verb)
                 raise uhttpd.BadRequestException(error_message)
+            if ttl:
+                if verb == 'get':
+                    return self.cached_response(f, api_request, relative_path, ttl)
+                #
+                # A modification may change what get requests return
+                #
+                self._cache.clear()
+            response = f(api_request)
+            #
+            # If the API handler is a coroutine, calling it returns a
+            # generator.  Return a generator in turn, which the server runs
+            # on the event loop
+            #
+            if type(response) is uhttpd.GeneratorType:
+                return self.await_response(response)
+            return self.create_response(response)
         else:
             error_message = "No handler found for components {}".format(components)
             raise uhttpd.NotFoundException(error_message)
-        ##
-        ## prepare response
-        ##
+
+    #
+    # Public operations
+    #
+
+    def invalidate(self):
+        self._cache.clear()
+
+    def cache_stats(self):
+        return self._cache.stats()
+
+    #
+    # Internal operations
+    #
+
+    def await_response(self, coroutine):
+        response = yield from coroutine
+        return self.create_response(response)
+
+    def cached_response(self, f, api_request, key, ttl):
+        #
+        # Serve the request from the cache, unless the entry has expired or
+        # the client's Cache-Control directives rule it out (no-cache, or an
+        # entry older than max-age).  Otherwise, call the handler, and cache
+        # the serialized response, unless the client asked for no-store.
+        #
+        cache = self._cache
+        no_cache, no_store, max_age = Handler.parse_cache_control(
+            api_request['http']['headers'].get('cache-control')
+        )
+        now = utime.ticks_ms()
+        ttl_ms = int(ttl * 1000)
+        if not no_cache and not no_store:
+            entry = cache.get(key, now)
+            if entry is not None:
+                age = (ttl_ms - utime.ticks_diff(entry[0], now)) // 1000
+                if max_age is None or age <= max_age:
+                    cache.hits += 1
+                    return Handler.create_cached_response(entry[1], entry[2], age)
+        cache.misses += 1
+        store_key = None if no_store else key
+        response = f(api_request)
+        if type(response) is uhttpd.GeneratorType:
+            return self.await_cached_response(response, store_key, ttl_ms)
+        return self.cache_response(response, store_key, ttl_ms)
+
+    def await_cached_response(self, coroutine, key, ttl_ms):
+        response = yield from coroutine
+        return self.cache_response(response, key, ttl_ms)
+
+    def cache_response(self, response, key, ttl_ms):
+        response_type = type(response)
+        if response_type is dict or response_type is list:
+            if self._stream_json:
+                #
+                # Only encode as much of the response as could be cached,
+                # and stream the response if it would not fit
+                #
+                data = None if key is None else Handler.encode_json(response, self._cache.max_bytes - len(key))
+                if data is None:
+                    return self.create_response(response)
+            else:
+                data = ujson.dumps(response).encode('UTF-8')
+            content_type = "application/json"
+        elif response_type is bytes:
+            data = response
+            content_type = "application/binary"
+        elif response_type is str:
+            data = response.encode("UTF-8")
+            content_type = "text/html; charset=utf-8"
+        else:
+            return self.create_response(response)
+        if key is not None:
+            self._cache.put(key, utime.ticks_add(utime.ticks_ms(), ttl_ms), data, content_type)
+        return Handler.create_cached_response(data, content_type, 0)
+
+    @staticmethod
+    def encode_json(obj, max_bytes):
+        #
+        # Returns the JSON encoding of obj, or None, if it is longer than
+        # max_bytes
+        #
+        data = bytearray()
+        for fragment in iter_json(obj):
+            data.extend(fragment.encode('UTF-8'))
+            if len(data) > max_bytes:
+                return None
+        return data
+
+    @staticmethod
+    def create_cached_response(data, content_type, age):
+        return {
+            'code': 200,
+            'headers': {
+                'content-length': len(data),
+                'content-type': content_type,
+                'age': age
+            },
+            'body': lambda stream: stream.awrite(data)
+        }
+
+    @staticmethod
+    def parse_cache_control(value):
+        no_cache = no_store = False
+        max_age = None
+        if value:
+            for directive in value.split(','):
+                directive = directive.strip().lower()
+                if directive == 'no-cache' or directive == 'max-age=0':
+                    no_cache = True
+                elif directive == 'no-store':
+                    no_store = True
+                elif directive.startswith('max-age='):
+                    try:
+                        max_age = int(directive[8:])
+                    except ValueError:
+                        pass
+        return no_cache, no_store, max_age
+
+    def create_response(self, response):
         if response is not None:
             response_type = type(response)
-            if response_type is dict or response_type is list:
+            if (response_type is dict or response_type is list) and self._stream_json:
+                body = lambda stream: Handler.stream_json(stream, response, self._chunk_size)
+                content_type = "application/json"
+                content_length = None
+            elif response_type is dict or response_type is list:
                 data = ujson.dumps(response).encode('UTF-8')
                 body = lambda stream : stream.awrite(data)
                 content_type = "application/json"
@@ -106,7 +337,7 @@ class Handler:
             content_type = None
             content_length = None
         headers = {}
-        if content_length :
+        if content_length is not None:
             headers.update({'content-length': content_length})
         if content_type:
             headers.update({'content-type': content_type})
@@ -116,16 +347,36 @@ class Handler:
             'body': body
         }
 
-    #
-    # Internal operations
-    #
-
-    def find_handler(self, components):
-        for prefix, handler in self._handlers:
-            prefix_len = len(prefix)
-            if prefix == components[:prefix_len]:
-                return prefix, handler, components[prefix_len:]
-        return None, None, None
+    @staticmethod
+    def stream_json(stream, obj, chunk_size):
+        #
+        # Fill a fixed size buffer with the JSON encoding of obj, and write
+        # it out each time it fills up, so that memory use is bounded by the
+        # size of the buffer, rather than by the size of the response.
+        #
+        buf = bytearray(chunk_size)
+        n = 0
+        for fragment in iter_json(obj):
+            data = fragment.encode('UTF-8')
+            m = len(data)
+            if n + m <= chunk_size:
+                buf[n:n + m] = data
+                n += m
+                if n == chunk_size:
+                    yield from stream.awrite(buf, 0, n)
+                    n = 0
+                continue
+            i = 0
+            while i < m:
+                k = min(m - i, chunk_size - n)
+                buf[n:n + k] = data[i:i + k]
+                n += k
+                i += k
+                if n == chunk_size:
+                    yield from stream.awrite(buf, 0, n)
+                    n = 0
+        if n > 0:
+            yield from stream.awrite(buf, 0, n)
 
     @staticmethod
     def extract_query(path):
@@ -0,0 +1,227 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import ubinascii
+import uhashlib
+import uos
+import utime
+import uhttpd
+
+SESSION_COOKIE = "uhttpd_session"
+
+HASH_PREFIX = "sha256$"
+
+
+def compare_digest(a, b):
+    #
+    # Compares a and b in time that depends only on their length, so that
+    # the time taken does not reveal how much of a secret was guessed
+    #
+    if type(a) is str:
+        a = a.encode()
+    if type(b) is str:
+        b = b.encode()
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= x ^ y
+    return result == 0
+
+
+def hash_password(password, salt=None, iterations=1000):
+    #
+    # Returns a string of the form sha256$<iterations>$<salt>$<digest>,
+    # which may be used in place of a plaintext password in the server
+    # configuration
+    #
+    if salt is None:
+        salt = ubinascii.hexlify(uos.urandom(8)).decode()
+    return "{}{}${}${}".format(
+        HASH_PREFIX, iterations, salt, ubinascii.hexlify(digest_password(password, salt, iterations)).decode()
+    )
+
+
+def digest_password(password, salt, iterations):
+    data = (salt + password).encode()
+    digest = b''
+    for i in range(iterations):
+        digest = uhashlib.sha256(digest + data).digest()
+    return digest
+
+
+def verify_password(password, stored):
+    #
+    # Checks password against a stored password, which is either a hash
+    # (see hash_password) or plaintext
+    #
+    if stored.startswith(HASH_PREFIX):
+        iterations, salt, digest = stored[len(HASH_PREFIX):].split('$')
+        return compare_digest(
+            ubinascii.hexlify(digest_password(password, salt, int(iterations))), digest
+        )
+    return compare_digest(password, stored)
+
+
+def hmac_pads(key):
+    #
+    # Returns the inner and outer padded keys for HMAC-SHA256 (RFC 2104).
+    # MicroPython hash objects cannot be copied, so the padded keys are
+    # computed once, rather than the hash states.
+    #
+    if len(key) > 64:
+        key = uhashlib.sha256(key).digest()
+    key = key + b'\x00' * (64 - len(key))
+    return bytes(b ^ 0x36 for b in key), bytes(b ^ 0x5C for b in key)
+
+
+def hmac_sha256(pads, message):
+    inner = uhashlib.sha256(pads[0])
+    inner.update(message)
+    outer = uhashlib.sha256(pads[1])
+    outer.update(inner.digest())
+    return outer.digest()
+
+
+class Authenticator:
+    #
+    # Authenticates requests using HTTP Basic authentication, against a
+    # single user and (plaintext or hashed) password.
+    #
+    # Verified authorization headers are kept in a bounded cache for up to
+    # cache_ttl seconds, so that repeat requests skip decoding and checking
+    # the credentials (which, for hashed passwords, is deliberately slow).
+    # If session_ttl is set, a client whose credentials are verified (rather
+    # than found in the cache) is also issued a session cookie, signed with
+    # session_secret (or with a random key, if none is given, in which case
+    # sessions do not survive a restart), which authenticates it for up to
+    # session_ttl seconds.
+    # Changing the password clears the cache and invalidates all sessions.
+    #
+    def __init__(self, user, password, cache_size=4, cache_ttl=300, session_ttl=None, session_secret=None):
+        self._user = user
+        self._cache = {}
+        self._cache_size = cache_size
+        self._cache_ttl_ms = cache_ttl * 1000
+        self._session_ttl = session_ttl
+        if session_secret is None:
+            session_secret = uos.urandom(32)
+        elif type(session_secret) is str:
+            session_secret = session_secret.encode()
+        self._session_secret = session_secret
+        self.set_password(password)
+
+    def set_password(self, password):
+        self._password = password
+        self._cache.clear()
+        #
+        # Sessions are signed with a key derived from the password, so
+        # that changing the password invalidates them
+        #
+        self._pads = hmac_pads(self._session_secret + password.encode())
+
+    def authenticate(self, headers):
+        #
+        # Returns (user, verified, session_cookie), where user is None if
+        # the request is not authenticated, verified indicates whether the
+        # credentials were checked (rather than found in the cache, or in
+        # a session cookie), and session_cookie is a set-cookie header
+        # value to send, or None
+        #
+        if self._session_ttl:
+            cookie = headers.get('cookie')
+            if cookie:
+                user = self.check_session(cookie)
+                if user is not None:
+                    return user, False, None
+        authorization = headers.get('authorization')
+        if authorization is None:
+            return None, False, None
+        now = utime.ticks_ms()
+        entry = self._cache.get(authorization)
+        if entry is not None:
+            if utime.ticks_diff(entry[1], now) > 0:
+                return entry[0], False, None
+            del self._cache[authorization]
+        user, password = Authenticator.decode_basic(authorization)
+        if not (compare_digest(user, self._user) & verify_password(password, self._password)):
+            return None, False, None
+        session_cookie = self.create_session(user) if self._session_ttl else None
+        if self._cache_size > 0:
+            cache = self._cache
+            if len(cache) >= self._cache_size:
+                cache.popitem()
+            cache[authorization] = (user, utime.ticks_add(now, self._cache_ttl_ms))
+        return user, True, session_cookie
+
+    #
+    # Internal operations
+    #
+
+    @staticmethod
+    def decode_basic(authorization):
+        try:
+            tmp = authorization.split()
+            if tmp[0].lower() != "basic":
+                raise uhttpd.BadRequestException(
+                    "Unsupported authorization method: {}".format(tmp[0]))
+            credentials = ubinascii.a2b_base64(tmp[1].strip().encode()).decode()
+            i = credentials.index(':')
+            return credentials[:i], credentials[i + 1:]
+        except uhttpd.BadRequestException:
+            raise
+        except Exception as e:
+            raise uhttpd.BadRequestException(e)
+
+    def sign(self, user, expires):
+        return ubinascii.hexlify(hmac_sha256(self._pads, "{}:{}".format(user, expires).encode())).decode()
+
+    def create_session(self, user):
+        expires = int(utime.time()) + self._session_ttl
+        return "{}={}:{}:{}; Path=/; Max-Age={}; HttpOnly".format(
+            SESSION_COOKIE, user, expires, self.sign(user, expires), self._session_ttl
+        )
+
+    def check_session(self, cookie):
+        token = None
+        for pair in cookie.split(';'):
+            name, _, value = pair.strip().partition('=')
+            if name == SESSION_COOKIE:
+                token = value
+                break
+        if token is None:
+            return None
+        parts = token.strip().rsplit(':', 2)
+        if len(parts) != 3:
+            return None
+        user, expires, signature = parts
+        try:
+            if int(expires) < int(utime.time()):
+                return None
+        except ValueError:
+            return None
+        if not compare_digest(signature, self.sign(user, expires)) or user != self._user:
+            return None
+        return user
@@ -0,0 +1,239 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# Serves files from a bundle, a single read-only file containing the
+# contents of a directory tree, produced on the development host by
+# bin/pack-assets.py.  The bundle starts with an index of the files it
+# contains, sorted by path, so that a file is located by a binary search of
+# the index, and its contents are read through a single open file handle,
+# rather than by walking the file system.
+#
+# The bundle consists of an 8 byte header (the magic number b'UHB1' and the
+# number of files), a table of the (4 byte) offsets of the index records,
+# in path order, the index records, and the file contents.  Each (17 byte)
+# record contains the offset, length, and modification time of a file,
+# flags, and the lengths of the (UTF-8) path (2 bytes), content type, and
+# entity tag (1 byte each) of the file that follow it.  All integers are
+# little endian, and modification times are relative to the Unix epoch.
+#
+import ustruct
+import uhttpd
+import uhttpd.file_handler
+
+MAGIC = b'UHB1'
+HEADER_FORMAT = "<4sHH"
+HEADER_SIZE = 8
+RECORD_FORMAT = "<IIIBHBB"
+RECORD_SIZE = 17
+
+#
+# The file is the gzip compressed variant of the file at the path without
+# the .gz suffix, with the content type of that file.
+#
+FLAG_GZIP = 0x01
+
+
+class Bundle:
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        magic, count, _ = ustruct.unpack(HEADER_FORMAT, self._file.read(HEADER_SIZE))
+        if magic != MAGIC:
+            self._file.close()
+            raise ValueError("Not a bundle: {}".format(path))
+        self._count = count
+        self._index = self._file.read(4 * count)
+
+    def close(self):
+        self._file.close()
+
+    def __len__(self):
+        return self._count
+
+    def find(self, path):
+        #
+        # Returns the (path, offset, length, mtime, flags, content_type,
+        # etag) record for the file at path, or None, if the bundle does not
+        # contain it.
+        #
+        i = self.bisect(path)
+        if i < self._count and self.read_path(i) == path:
+            return self.read_record(i)
+        return None
+
+    def is_dir(self, path):
+        prefix = path.rstrip('/') + '/'
+        i = self.bisect(prefix)
+        return i < self._count and self.read_path(i).startswith(prefix)
+
+    def listdir(self, path):
+        #
+        # Generates a (name, is_dir, size, mtime) tuple for each entry in
+        # the directory at path.  Paths with a common prefix are adjacent in
+        # the index, so the entries are found by scanning forward from the
+        # first path in the directory.
+        #
+        prefix = path.rstrip('/') + '/'
+        n = len(prefix)
+        last = None
+        i = self.bisect(prefix)
+        while i < self._count:
+            record = self.read_record(i)
+            if not record[0].startswith(prefix):
+                break
+            slash = record[0].find('/', n)
+            if slash == -1:
+                yield record[0][n:], False, record[2], record[3]
+            else:
+                name = record[0][n:slash]
+                if name != last:
+                    last = name
+                    yield name, True, 0, record[3]
+            i += 1
+
+    def readinto(self, buf, position):
+        #
+        # Reads into buf from the absolute position in the bundle.  The file
+        # handle is shared by all responses, so every read seeks first.
+        #
+        f = self._file
+        f.seek(position)
+        return f.readinto(buf)
+
+    #
+    # internal operations
+    #
+
+    def bisect(self, path):
+        #
+        # Returns the index of the first path in the bundle not less than
+        # path
+        #
+        lo = 0
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.read_path(mid) < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def seek_record(self, i):
+        f = self._file
+        f.seek(ustruct.unpack_from("<I", self._index, 4 * i)[0])
+        return ustruct.unpack(RECORD_FORMAT, f.read(RECORD_SIZE))
+
+    def read_path(self, i):
+        path_length = self.seek_record(i)[4]
+        return self._file.read(path_length).decode('UTF-8')
+
+    def read_record(self, i):
+        offset, length, mtime, flags, path_length, type_length, etag_length = self.seek_record(i)
+        data = self._file.read(path_length + type_length + etag_length).decode('UTF-8')
+        return (
+            data[:path_length],
+            offset,
+            length,
+            mtime - uhttpd.file_handler.EPOCH_OFFSET if mtime else 0,
+            flags,
+            data[path_length:path_length + type_length],
+            data[path_length + type_length:]
+        )
+
+
+class Handler(uhttpd.file_handler.Handler):
+    #
+    # A file handler that serves files from a bundle, instead of from a
+    # directory on the file system.  The bundle may be specified by the path
+    # to the bundle file, or as a Bundle object.
+    #
+    def __init__(self, bundle, block_size=1024, max_cache_entries=32, max_age=None, gzip=True,
+                 buffer_pool=None):
+        self._bundle = bundle if isinstance(bundle, Bundle) else Bundle(bundle)
+        uhttpd.file_handler.Handler.__init__(
+            self, '', block_size=block_size, max_cache_entries=max_cache_entries,
+            max_age=max_age, gzip=gzip, buffer_pool=buffer_pool
+        )
+
+    #
+    # internal operations
+    #
+
+    @staticmethod
+    def check_root_path(root_path):
+        pass
+
+    def load_entry(self, absolute_path):
+        bundle = self._bundle
+        record = bundle.find(absolute_path)
+        if record is None:
+            if not bundle.is_dir(absolute_path):
+                return None
+            absolute_path = absolute_path.rstrip('/') + "/index.html"
+            record = bundle.find(absolute_path)
+            if record is None:
+                return uhttpd.file_handler.DIR_ENTRY
+        variant = None
+        if self._gzip:
+            gzip_record = bundle.find(absolute_path + ".gz")
+            if gzip_record is not None and gzip_record[4] & FLAG_GZIP:
+                variant = self.create_bundle_entry(gzip_record, None)
+        return self.create_bundle_entry(record, variant)
+
+    @staticmethod
+    def create_bundle_entry(record, variant):
+        path, offset, length, mtime, flags, content_type, etag = record
+        return (
+            path,
+            length,
+            content_type,
+            etag,
+            uhttpd.file_handler.http_date(mtime) if mtime > 0 else None,
+            'gzip' if flags & FLAG_GZIP else None,
+            variant,
+            offset
+        )
+
+    def stream_file(self, stream, offset, start=0, length=-1):
+        bundle = self._bundle
+        buffers = self._buffers
+        buf = buffers.acquire()
+        position = offset + start
+        try:
+            while length:
+                n = bundle.readinto(buf, position)
+                if not n:
+                    break
+                if 0 < length < n:
+                    n = length
+                yield from stream.awrite(buf, 0, n)
+                position += n
+                length -= n
+        finally:
+            buffers.release(buf)
+
+    def list_dir(self, absolute_path, details=False):
+        return self._bundle.listdir(absolute_path)
@@ -24,35 +24,102 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 import uos
+import utime
+import ujson
 import logging
 import uhttpd
 
+S_IFDIR = 0x4000
+
 CONTENT_TYPE_MAP = {
     ".html": "text/html",
     ".js": "text/javascript",
     ".css": "text/css"
 }
 
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+          "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+DIR_ENTRY = (None, 0, "text/html", None, None, None, None, None)
+
+#
+# The number of seconds between the Unix epoch and the epoch of the port,
+# for files packed on the development host, and for directory listings.
+# Some ports (e.g., the ESP8266) count seconds from 2000-01-01.
+#
+EPOCH_OFFSET = 946684800 if utime.localtime(0)[0] == 2000 else 0
+
 
 def is_dir(path):
     try:
-        listdir(path)
-        return True
+        return uos.stat(path)[0] & S_IFDIR != 0
     except OSError:
         return False
 
 
-def listdir(path):
-    import sys
-    if sys.platform == 'esp8266':
-        return uos.listdir(path)
+def ilistdir(path):
+    #
+    # Generates the names of the entries in the directory at path, without
+    # building a list of them, where the port supports it
+    #
+    if hasattr(uos, 'ilistdir'):
+        for entry in uos.ilistdir(path):
+            yield entry[0]
     else:
-        ret = []
-        for name, size, modified in uos.ilistdir(path):
-            ret.append(name)
-        if ret == []:
-            raise OSError()
-        return ret
+        for name in uos.listdir(path):
+            yield name
+
+
+def http_date(secs):
+    year, month, mday, hour, minute, second, weekday = utime.localtime(secs)[:7]
+    return "{}, {:02d} {} {} {:02d}:{:02d}:{:02d} GMT".format(
+        DAYS[weekday], mday, MONTHS[month - 1], year, hour, minute, second
+    )
+
+
+def accepts_gzip(accept_encoding):
+    if accept_encoding is None:
+        return False
+    for coding in accept_encoding.split(','):
+        params = coding.split(';')
+        if params[0].strip() in ('gzip', '*'):
+            for param in params[1:]:
+                if param.strip() in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                    return False
+            return True
+    return False
+
+
+def parse_range(value, size):
+    #
+    # Returns the (first, last) byte positions (inclusive) of a single
+    # byte range, where first is at least size if the range cannot be
+    # satisfied, or None, if the range should be ignored (e.g., because it
+    # is malformed or specifies multiple ranges).
+    #
+    value = value.strip()
+    if not value.startswith("bytes=") or ',' in value:
+        return None
+    positions = value[6:].split('-')
+    if len(positions) != 2:
+        return None
+    first, last = positions
+    try:
+        if not first.strip():
+            suffix_length = int(last)
+            if suffix_length == 0:
+                return size, size - 1
+            return max(size - suffix_length, 0), size - 1
+        first = int(first)
+        last = size - 1 if not last.strip() else min(int(last), size - 1)
+    except ValueError:
+        return None
+    if first > last and first < size:
+        return None
+    return first, last
+
 
 def exists(path):
     try:
@@ -62,12 +129,27 @@ def exists(path):
         return False
 
 class Handler:
-    def __init__(self, root_path='/www', block_size=1024):
-        if not exists(root_path) or not is_dir(root_path):
-            msg = "Root path {} is not an existing directory".format(root_path)
-            raise Exception(msg)
+    def __init__(self, root_path='/www', block_size=1024, writable=False, max_body_length=256 * 1024,
+                 max_cache_entries=32, max_age=None, gzip=True, buffer_pool=None):
+        self.check_root_path(root_path)
         self._root_path = root_path
         self._block_size = block_size
+        self._buffers = buffer_pool if buffer_pool else uhttpd.BufferPool(block_size)
+        self._writable = writable
+        #
+        # If files may be written, request bodies are streamed to this
+        # handler, so that they can be written as they arrive.
+        #
+        self.stream_body = writable
+        self.max_body_length = max_body_length
+        #
+        # Cache of file metadata, keyed by absolute path, so that serving
+        # a file does not require repeated stats of the filesystem
+        #
+        self._cache = {}
+        self._max_cache_entries = max_cache_entries
+        self._max_age = max_age
+        self._gzip = gzip
 
     #
     # callbacks
@@ -75,9 +157,11 @@ class Handler:
 
     def handle_request(self, http_request):
         #
-        # We only support GET
+        # We only support GET, and PUT, if the handler is writable
         #
         verb = http_request['verb']
+        if verb == 'put' and self._writable:
+            return self.handle_put(http_request)
         if verb != 'get':
             raise uhttpd.BadRequestException("Unsupported HTTP verb: {}".format(verb))
         # the relative path is the path on the HTTP request stripped of the
@@ -97,64 +181,273 @@ class Handler:
         #
         # If the path doesn't exist, 404 out
         #
-        if not exists(absolute_path):
+        entry = self.lookup(absolute_path)
+        if entry is None:
             logging.info(
                 "NOT_FOUND {} {}".format(remote_addr, absolute_path))
             raise uhttpd.NotFoundException(absolute_path)
         #
-        # Otherwise, generate a file listing or a file
+        # Otherwise, generate a file listing or a file.  A directory
+        # containing an index.html resolves to the index file in the cache.
         #
-        if is_dir(absolute_path):
-            index_path = absolute_path + "/index.html"
-            if exists(index_path):
-                response = self.create_file_response(index_path)
-                logging.info("ACCESS {} {}".format(remote_addr, index_path))
-                return response
-            else:
-                logging.info("ACCESS {} {}".format(remote_addr, absolute_path))
-                prefix = http_request['prefix']
-                return self.create_dir_listing_response(absolute_path)
-        else:
+        path = entry[0]
+        if path is None:
             logging.info("ACCESS {} {}".format(remote_addr, absolute_path))
-            return self.create_file_response(absolute_path)
+            return self.create_dir_listing_response(http_request, absolute_path)
+        #
+        # Serve the pre-compressed variant of the file, if there is one and
+        # the client accepts it
+        #
+        headers = http_request['headers']
+        if entry[6] is not None and accepts_gzip(headers.get('accept-encoding')):
+            entry = entry[6]
+            path = entry[0]
+        logging.info("ACCESS {} {}".format(remote_addr, path))
+        if self.is_not_modified(headers, entry):
+            return {
+                'code': 304,
+                'headers': self.create_validator_headers(entry)
+            }
+        #
+        # Serve a single range of the file, if one was requested, unless
+        # an if-range header indicates the client's copy is out of date
+        #
+        range_header = headers.get('range')
+        if range_header is not None and self.is_range_current(headers, entry):
+            byte_range = parse_range(range_header, entry[1])
+            if byte_range is not None:
+                return self.create_range_response(entry, byte_range[0], byte_range[1])
+        return self.create_file_response(entry)
+
+    def invalidate(self, path=None):
+        #
+        # Drop cached metadata for the specified absolute (filesystem) path
+        # and its parent directory, or for all paths, if no path is given.
+        # Call this if files under the root path are modified other than
+        # through this handler.
+        #
+        if path is None:
+            self._cache.clear()
+        else:
+            path = path.rstrip('/')
+            self._cache.pop(path, None)
+            self._cache.pop(path[:path.rfind('/')], None)
+            if path.endswith(".gz"):
+                self._cache.pop(path[:-3], None)
+
+    def handle_put(self, http_request):
+        relative_path = uhttpd.get_relative_path(http_request)
+        absolute_path = self.effective_path(relative_path)
+        remote_addr = http_request['tcp']['remote_addr']
+        if not self.is_prefix(self._root_path + '/', absolute_path):
+            logging.info(
+                "FORBIDDEN {} {}".format(remote_addr, absolute_path))
+            raise uhttpd.ForbiddenException(absolute_path)
+        if is_dir(absolute_path):
+            raise uhttpd.BadRequestException("Cannot PUT to a directory: {}".format(absolute_path))
+        parent = absolute_path[:absolute_path.rfind('/')]
+        if not is_dir(parent):
+            logging.info(
+                "NOT_FOUND {} {}".format(remote_addr, parent))
+            raise uhttpd.NotFoundException(parent)
+        created = not exists(absolute_path)
+        #
+        # Write the body to a temporary file as it arrives, a block at a
+        # time, and only replace the target file once the entire body has
+        # been written.
+        #
+        tmp_path = absolute_path + ".tmp"
+        reader = http_request.get('body_reader')
+        length = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                while reader:
+                    data = yield from reader.read(self._block_size)
+                    if not data:
+                        break
+                    f.write(data)
+                    length += len(data)
+            if not created:
+                uos.remove(absolute_path)
+            uos.rename(tmp_path, absolute_path)
+        except BaseException:
+            if exists(tmp_path):
+                uos.remove(tmp_path)
+            raise
+        self.invalidate(absolute_path)
+        logging.info("WRITE {} {} {}".format(remote_addr, absolute_path, length))
+        return {
+            'code': 201 if created else 204,
+            'headers': {}
+        }
 
     #
     # internal operations
     #
 
-    def create_file_response(self, path):
-        length, body = self.generate_file(path)
-        suffix = self.get_suffix(path)
+    @staticmethod
+    def check_root_path(root_path):
+        if not exists(root_path) or not is_dir(root_path):
+            msg = "Root path {} is not an existing directory".format(root_path)
+            raise Exception(msg)
+
+    def lookup(self, absolute_path):
+        cache = self._cache
+        entry = cache.get(absolute_path)
+        if entry is None:
+            entry = self.load_entry(absolute_path)
+            if entry is not None and self._max_cache_entries > 0:
+                if len(cache) >= self._max_cache_entries:
+                    cache.popitem()
+                cache[absolute_path] = entry
+        return entry
+
+    def load_entry(self, absolute_path):
+        #
+        # Returns a (path, size, content_type, etag, last_modified,
+        # encoding, variant, location) tuple, where path is the file to
+        # serve, or None, if the path is a directory without an index.html;
+        # or None, if nothing exists at the path.  If the handler serves gzip
+        # sidecars and a <path>.gz file exists, variant is the entry for that
+        # file, with a 'gzip' encoding.  The location is passed to
+        # stream_file to read the contents of the file (here, the path).
+        #
+        try:
+            st = uos.stat(absolute_path)
+        except OSError:
+            return None
+        if st[0] & S_IFDIR:
+            absolute_path += "/index.html"
+            try:
+                st = uos.stat(absolute_path)
+            except OSError:
+                return DIR_ENTRY
+            if st[0] & S_IFDIR:
+                return DIR_ENTRY
+        suffix = self.get_suffix(absolute_path)
         if suffix in CONTENT_TYPE_MAP:
             content_type = CONTENT_TYPE_MAP[suffix]
         else:
             content_type = "text/plain"
-        return self.create_response(200, content_type, length, body)
-
-    def generate_file(self, path):
-        f = open(path, 'r')
-        body = lambda stream: self.stream_file(stream, f)
-        return self.file_size(path), body
-
-    def create_buffer(self):
-        size = self._block_size
-        while True:
-            if size < 1:
-                raise Exception("Unable to allocate buffer")
+        variant = None
+        if self._gzip:
+            gzip_path = absolute_path + ".gz"
             try:
-                return bytearray(size)
-            except MemoryError:
-                size //= 2
+                gzip_st = uos.stat(gzip_path)
+                if not gzip_st[0] & S_IFDIR:
+                    variant = self.create_entry(gzip_path, gzip_st, content_type, 'gzip', None)
+            except OSError:
+                pass
+        return self.create_entry(absolute_path, st, content_type, None, variant)
 
+    @staticmethod
+    def create_entry(path, st, content_type, encoding, variant):
+        size = st[6]
+        mtime = st[8]
+        return (
+            path,
+            size,
+            content_type,
+            '"{:x}-{:x}{}"'.format(mtime, size, "-gz" if encoding else ""),
+            http_date(mtime) if mtime > 0 else None,
+            encoding,
+            variant,
+            path
+        )
 
-    def stream_file(self, stream, f):
-        buf = self.create_buffer()
-        while True:
-            n = f.readinto(buf)
-            if n:
-                yield from stream.awrite(buf[:n])
-            else:
-                break
+    @staticmethod
+    def is_not_modified(headers, entry):
+        etag = entry[3]
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            for tag in if_none_match.split(','):
+                tag = tag.strip()
+                if tag == etag or tag == '*' \
+                        or (tag.startswith('W/') and tag[2:] == etag):
+                    return True
+            return False
+        #
+        # Clients send back the Last-Modified value they were given, so
+        # an exact match avoids parsing dates.
+        #
+        last_modified = entry[4]
+        return last_modified is not None \
+            and headers.get('if-modified-since') == last_modified
+
+    def create_validator_headers(self, entry):
+        headers = {'etag': entry[3]}
+        if entry[4] is not None:
+            headers['last-modified'] = entry[4]
+        if self._max_age is not None:
+            headers['cache-control'] = "max-age={}".format(self._max_age)
+        if entry[5] is not None:
+            headers['content-encoding'] = entry[5]
+            headers['vary'] = 'accept-encoding'
+        elif entry[6] is not None:
+            headers['vary'] = 'accept-encoding'
+        return headers
+
+    @staticmethod
+    def is_range_current(headers, entry):
+        if_range = headers.get('if-range')
+        return if_range is None or if_range == entry[3] \
+            or (entry[4] is not None and if_range == entry[4])
+
+    def create_file_response(self, entry):
+        location, size, content_type = entry[7], entry[1], entry[2]
+        headers = self.create_validator_headers(entry)
+        headers['content-type'] = content_type
+        headers['content-length'] = size
+        headers['accept-ranges'] = 'bytes'
+        return {
+            'code': 200,
+            'headers': headers,
+            'body': lambda stream: self.stream_file(stream, location, 0, size)
+        }
+
+    def create_range_response(self, entry, first, last):
+        location, size = entry[7], entry[1]
+        if first >= size:
+            return {
+                'code': 416,
+                'headers': {
+                    'content-range': "bytes */{}".format(size)
+                }
+            }
+        length = last - first + 1
+        headers = self.create_validator_headers(entry)
+        headers['content-type'] = entry[2]
+        headers['content-length'] = length
+        headers['content-range'] = "bytes {}-{}/{}".format(first, last, size)
+        headers['accept-ranges'] = 'bytes'
+        return {
+            'code': 206,
+            'headers': headers,
+            'body': lambda stream: self.stream_file(stream, location, first, length)
+        }
+
+    def stream_file(self, stream, path, offset=0, length=-1):
+        #
+        # Blocks are read into a buffer borrowed from the pool and written
+        # from that buffer by offset and size, so that nothing is allocated
+        # per block.
+        #
+        buffers = self._buffers
+        buf = buffers.acquire()
+        try:
+            with open(path, 'rb') as f:
+                if offset:
+                    f.seek(offset)
+                while length:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    if 0 < length < n:
+                        n = length
+                    yield from stream.awrite(buf, 0, n)
+                    length -= n
+        finally:
+            buffers.release(buf)
 
     def effective_path(self, path):
         full_path = "{}/{}".format(self._root_path, path).rstrip('/')
@@ -179,44 +472,71 @@ class Handler:
         body = lambda stream: (yield from stream.awrite(data))
         return Handler.create_response(code, "text/html", length, body)
 
-    def create_dir_listing_response(self, absolute_path):
-        length, body = self.generate_dir_listing(absolute_path)
-        return self.create_response(200, "text/html", length, body)
-
-    def generate_dir_listing(self, absolute_path):
-        path = absolute_path[len(self._root_path):]
-        if not path:
-            path = '/'
-        data = "<html><body><header><em>uhttpd/{}</em><hr></header><h1>{}</h1><ul>".format(uhttpd.VERSION, path)
-        components = self.components(path)
-        components_len = len(components)
-        if components_len > 0:
-            data += "<li><a href=\"{}\">..</a></li>\n".format(self.to_path(components[:components_len-1]))
-        files = listdir(absolute_path)
-        for f in files:
-            tmp = components.copy()
-            tmp.append(f)
-            data += "<li><a href=\"{}\">{}</a></li>\n".format(self.to_path(tmp), f)
-        data += "</ul></body></html>"
-        data = data.encode('UTF-8')
-        body = lambda stream: stream.awrite(data)
-        return len(data), body
-
-    def to_path(self, components):
-        return "/{}".format("/".join(components))
-
-    def components(self, path):
-        f = lambda e: e != ''
-        return self.filter(
-            f, path.strip('/').split('/')
-        )
+    def create_dir_listing_response(self, http_request, absolute_path):
+        #
+        # Directory listings are streamed, an entry at a time, as the
+        # directory is read, so the length of the listing is not known in
+        # advance, and memory use does not grow with the size of the
+        # directory.  Clients that accept JSON get a JSON listing, with the
+        # size and modification time of each entry.
+        #
+        path = absolute_path[len(self._root_path):].rstrip('/')
+        accept = http_request['headers'].get('accept')
+        if accept and 'application/json' in accept:
+            content_type = "application/json"
+            body = lambda stream: self.write_json_listing(stream, absolute_path, path)
+        else:
+            content_type = "text/html"
+            body = lambda stream: self.write_html_listing(stream, absolute_path, path)
+        return {
+            'code': 200,
+            'headers': {
+                'content-type': content_type
+            },
+            'body': body
+        }
+
+    def list_dir(self, absolute_path, details=False):
+        #
+        # Generates a (name, is_dir, size, mtime) tuple for each entry in
+        # the directory at absolute_path.  Entries are only stat'ed if
+        # details are requested; otherwise, is_dir, size, and mtime are None.
+        #
+        for name in ilistdir(absolute_path):
+            if not details:
+                yield name, None, None, None
+                continue
+            try:
+                st = uos.stat("{}/{}".format(absolute_path, name))
+            except OSError:
+                continue
+            is_dir = st[0] & S_IFDIR != 0
+            yield name, is_dir, 0 if is_dir else st[6], st[8]
 
-    def filter(self, f, el):
-        ret = []
-        for e in el:
-            if f(e):
-                ret.append(e)
-        return ret
+    def write_html_listing(self, stream, absolute_path, path):
+        yield from stream.awrite("<html><body><header><em>uhttpd/{}</em><hr></header><h1>{}</h1><ul>".format(
+            uhttpd.VERSION, path if path else '/'
+        ))
+        if path:
+            yield from stream.awrite("<li><a href=\"{}\">..</a></li>\n".format(path[:path.rfind('/')] or '/'))
+        for name, _, _, _ in self.list_dir(absolute_path):
+            yield from stream.awrite("<li><a href=\"{}/{}\">{}</a></li>\n".format(path, name, name))
+        yield from stream.awrite("</ul></body></html>")
+
+    def write_json_listing(self, stream, absolute_path, path):
+        yield from stream.awrite("{{\"path\": {}, \"entries\": [".format(ujson.dumps(path if path else '/')))
+        separator = ""
+        for name, is_dir, size, mtime in self.list_dir(absolute_path, True):
+            #
+            # Report modification times as Unix time, rather than relative
+            # to the epoch of the port
+            #
+            yield from stream.awrite("{}{{\"name\": {}, \"type\": \"{}\", \"size\": {}, \"mtime\": {}}}".format(
+                separator, ujson.dumps(name), "dir" if is_dir else "file", size,
+                mtime + EPOCH_OFFSET if mtime else 0
+            ))
+            separator = ", "
+        yield from stream.awrite("]}")
 
     @staticmethod
     def create_response(code, content_type, length, body):
@@ -229,10 +549,6 @@ class Handler:
             'body': body
         }
 
-    @staticmethod
-    def file_size(path):
-        return uos.stat(path)[6]
-
     @staticmethod
     def get_suffix(path):
         idx = path.rfind('.')
@@ -0,0 +1,136 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# Serves files from a python module generated by bin/pack-assets.py -m, e.g.,
+#
+#     shell$ python3 bin/pack-assets.py -m www
+#
+# which writes www_assets.py.  When the module is frozen into the firmware,
+# the contents of the files are bytes constants in flash, so that files are
+# served without reading the file system, and without copying their
+# contents into RAM.  The entries for all files (and the directories that
+# contain them) are created when the handler is constructed, so that serving
+# a file requires a single dictionary lookup.
+#
+import uhttpd
+import uhttpd.file_handler
+
+#
+# The file is the gzip compressed variant of the file at the path without
+# the .gz suffix, with the content type of that file.
+#
+FLAG_GZIP = 0x01
+
+
+class Handler(uhttpd.file_handler.Handler):
+    #
+    # A file handler that serves the ASSETS of a generated module, e.g.,
+    #
+    #     >>> import www_assets
+    #     >>> frozen_handler = uhttpd.frozen.Handler(www_assets.ASSETS)
+    #
+    def __init__(self, assets, max_age=None, gzip=True):
+        uhttpd.file_handler.Handler.__init__(
+            self, '', max_cache_entries=0, max_age=max_age, gzip=gzip
+        )
+        self._assets = assets
+        self._entries = self.create_entries(assets)
+
+    #
+    # internal operations
+    #
+
+    @staticmethod
+    def check_root_path(root_path):
+        pass
+
+    def lookup(self, absolute_path):
+        return self._entries.get(absolute_path)
+
+    def create_entries(self, assets):
+        entries = {}
+        for path, content_type, etag, mtime, flags, data in assets:
+            entries[path] = self.create_frozen_entry(path, content_type, etag, mtime, flags, data, None)
+        if self._gzip:
+            for path, entry in entries.items():
+                variant = entries.get(path + ".gz")
+                if variant is not None and variant[5] is not None:
+                    entries[path] = entry[:6] + (variant, entry[7])
+        #
+        # A directory resolves to its index.html, if it has one, as it
+        # would on the file system
+        #
+        for path, _, _, _, _, _ in assets:
+            while path:
+                path = path[:path.rfind('/')]
+                dir_path = path or '/'
+                if dir_path in entries:
+                    break
+                entries[dir_path] = entries.get(path + "/index.html", uhttpd.file_handler.DIR_ENTRY)
+        return entries
+
+    @staticmethod
+    def create_frozen_entry(path, content_type, etag, mtime, flags, data, variant):
+        mtime = mtime - uhttpd.file_handler.EPOCH_OFFSET if mtime else 0
+        return (
+            path,
+            len(data),
+            content_type,
+            etag,
+            uhttpd.file_handler.http_date(mtime) if mtime > 0 else None,
+            'gzip' if flags & FLAG_GZIP else None,
+            variant,
+            data
+        )
+
+    def stream_file(self, stream, data, offset=0, length=-1):
+        #
+        # The file is written straight from the constant, by offset and
+        # size, in a single write, so that a buffered stream passes it
+        # through rather than copying it into its buffer (unless the range
+        # is smaller than the buffer)
+        #
+        if length == -1:
+            length = len(data) - offset
+        if length > 0:
+            yield from stream.awrite(data, offset, length)
+
+    def list_dir(self, absolute_path, details=False):
+        prefix = absolute_path.rstrip('/') + '/'
+        n = len(prefix)
+        last = None
+        for path, _, _, mtime, _, data in self._assets:
+            if not path.startswith(prefix):
+                continue
+            slash = path.find('/', n)
+            mtime = mtime - uhttpd.file_handler.EPOCH_OFFSET if mtime else 0
+            if slash == -1:
+                yield path[n:], False, len(data), mtime
+            else:
+                name = path[n:slash]
+                if name != last:
+                    last = name
+                    yield name, True, 0, mtime
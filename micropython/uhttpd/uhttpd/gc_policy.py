@@ -0,0 +1,164 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import gc
+import utime
+
+
+class Policy:
+    #
+    # Decides when the server runs the garbage collector.  The server calls
+    # on_connect when a connection is admitted, on_request after each
+    # request on a connection, and on_close when a connection is closed.
+    # This base policy never collects, leaving collection to the allocator
+    # (which collects when an allocation fails).
+    #
+    # Collections run by a policy are counted, and their pauses timed, in
+    # the server statistics, along with the lowest free heap observed
+    # after a collection (the headroom).
+    #
+    def install(self, stats):
+        self._stats = stats
+        stats['gc_collections'] = 0
+        stats['gc_pause_us'] = 0
+        stats['gc_max_pause_us'] = 0
+        stats['gc_min_free'] = gc.mem_free()
+
+    def on_connect(self):
+        pass
+
+    def on_request(self):
+        pass
+
+    def on_close(self):
+        pass
+
+    def collect(self):
+        start = utime.ticks_us()
+        gc.collect()
+        pause = utime.ticks_diff(utime.ticks_us(), start)
+        stats = self._stats
+        stats['gc_collections'] += 1
+        stats['gc_pause_us'] += pause
+        if pause > stats['gc_max_pause_us']:
+            stats['gc_max_pause_us'] = pause
+        self.observe_free(gc.mem_free())
+
+    def observe_free(self, free):
+        if free < self._stats['gc_min_free']:
+            self._stats['gc_min_free'] = free
+
+
+class Always(Policy):
+    #
+    # Collects when each connection is opened, after each request, and
+    # when each connection is closed.  This keeps the heap as compact as
+    # possible, at the cost of a pause (typically several milliseconds on
+    # an ESP8266) on every request.
+    #
+    def on_connect(self):
+        self.collect()
+
+    def on_request(self):
+        self.collect()
+
+    def on_close(self):
+        self.collect()
+
+
+class Watermark(Policy):
+    #
+    # Collects between requests, but only once the free heap drops below
+    # low_watermark bytes, so that the pause is taken between requests,
+    # rather than when an allocation fails in the middle of one.
+    #
+    def __init__(self, low_watermark=8 * 1024):
+        self._low_watermark = low_watermark
+
+    def on_connect(self):
+        self.check()
+
+    def on_request(self):
+        self.check()
+
+    def check(self):
+        if gc.mem_free() < self._low_watermark:
+            self.collect()
+
+
+class AllocationRate(Policy):
+    #
+    # Collects between requests, once max_alloc bytes have been allocated
+    # since the last collection, so that collections keep pace with the
+    # rate at which requests allocate memory.
+    #
+    def __init__(self, max_alloc=8 * 1024):
+        self._max_alloc = max_alloc
+        self._baseline = 0
+
+    def install(self, stats):
+        super().install(stats)
+        self._baseline = gc.mem_alloc()
+
+    def on_connect(self):
+        self.check()
+
+    def on_request(self):
+        self.check()
+
+    def check(self):
+        alloc = gc.mem_alloc()
+        if alloc < self._baseline:
+            #
+            # The allocator collected since we last looked
+            #
+            self._baseline = alloc
+        elif alloc - self._baseline >= self._max_alloc:
+            self.collect()
+            self._baseline = gc.mem_alloc()
+
+
+class Threshold(Policy):
+    #
+    # Sets the allocation threshold of the garbage collector (gc.threshold),
+    # so that the allocator collects once threshold bytes have been
+    # allocated since the last collection, and never collects explicitly.
+    # By default, the threshold is set to a quarter of the free heap, plus
+    # the heap in use, when the server starts.  As these collections are
+    # run by the allocator, they are not counted in the statistics, but the
+    # free heap is sampled when each connection is closed.
+    #
+    def __init__(self, threshold=None):
+        self._threshold = threshold
+
+    def install(self, stats):
+        super().install(stats)
+        threshold = self._threshold
+        if threshold is None:
+            threshold = gc.mem_free() // 4 + gc.mem_alloc()
+        gc.threshold(threshold)
+
+    def on_close(self):
+        self.observe_free(gc.mem_free())
@@ -0,0 +1,217 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import gc
+import array
+import uhttpd
+
+#
+# Upper bounds (in microseconds) of the latency histogram buckets
+#
+BUCKETS = (1000, 5000, 10000, 50000, 100000, 500000, 1000000, 5000000)
+
+PHASES = ('parse', 'handler', 'write')
+
+#
+# Server statistics that are gauges, rather than counters
+#
+GAUGES = ('active_connections', 'gc_max_pause_us', 'gc_min_free')
+
+
+def format_us(us):
+    return "{}.{:06d}".format(us // 1000000, us % 1000000)
+
+
+class RouteMetrics:
+    #
+    # The metrics for the requests dispatched to a single route (handler
+    # prefix).  The bucket counts of the histograms for each phase are
+    # stored in a single fixed-size array, and are not cumulative.
+    #
+    def __init__(self, n_buckets):
+        self.histograms = array.array('L', [0] * (len(PHASES) * (n_buckets + 1)))
+        self.sums = [0] * len(PHASES)
+        self.count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.codes = {}
+
+
+class Metrics:
+    #
+    # Collects per-route request metrics.  Pass an instance to the server
+    # in the 'metrics' configuration parameter, and to a Handler, to
+    # expose the metrics in the Prometheus text format.
+    #
+    def __init__(self, buckets=BUCKETS):
+        self._buckets = buckets
+        self._labels = [format_us(b) for b in buckets] + ["+Inf"]
+        self._routes = {}
+        self._stats = None
+
+    def set_stats(self, stats):
+        self._stats = stats
+
+    def observe(self, route, code, parse_us, handler_us, write_us, bytes_in, bytes_out):
+        metrics = self._routes.get(route)
+        if metrics is None:
+            metrics = RouteMetrics(len(self._buckets))
+            self._routes[route] = metrics
+        buckets = self._buckets
+        n = len(buckets) + 1
+        histograms = metrics.histograms
+        sums = metrics.sums
+        i = 0
+        for us in (parse_us, handler_us, write_us):
+            j = 0
+            while j < n - 1 and us > buckets[j]:
+                j += 1
+            histograms[i * n + j] += 1
+            sums[i] += us
+            i += 1
+        metrics.count += 1
+        metrics.bytes_in += bytes_in
+        metrics.bytes_out += bytes_out
+        codes = metrics.codes
+        codes[code] = codes.get(code, 0) + 1
+
+    def write(self, stream):
+        #
+        # Writes the metrics to the stream in the Prometheus text format
+        #
+        routes = self._routes
+        labels = self._labels
+        n = len(labels)
+        i = 0
+        for phase in PHASES:
+            name = "uhttpd_{}_seconds".format(phase)
+            yield from stream.awrite("# TYPE {} histogram\n".format(name))
+            for route, metrics in routes.items():
+                histograms = metrics.histograms
+                total = 0
+                for j in range(n):
+                    total += histograms[i * n + j]
+                    yield from stream.awrite('{}_bucket{{route="{}",le="{}"}} {}\n'.format(
+                        name, route, labels[j], total
+                    ))
+                yield from stream.awrite('{}_sum{{route="{}"}} {}\n{}_count{{route="{}"}} {}\n'.format(
+                    name, route, format_us(metrics.sums[i]), name, route, metrics.count
+                ))
+            i += 1
+        yield from stream.awrite("# TYPE uhttpd_requests_total counter\n")
+        for route, metrics in routes.items():
+            for code, count in metrics.codes.items():
+                yield from stream.awrite('uhttpd_requests_total{{route="{}",code="{}"}} {}\n'.format(
+                    route, code, count
+                ))
+        for name, attr in (('received', 'bytes_in'), ('sent', 'bytes_out')):
+            yield from stream.awrite("# TYPE uhttpd_{}_bytes_total counter\n".format(name))
+            for route, metrics in routes.items():
+                yield from stream.awrite('uhttpd_{}_bytes_total{{route="{}"}} {}\n'.format(
+                    name, route, getattr(metrics, attr)
+                ))
+        if self._stats:
+            for key, value in self._stats.items():
+                if key in GAUGES:
+                    yield from stream.awrite("# TYPE uhttpd_{0} gauge\nuhttpd_{0} {1}\n".format(key, value))
+                else:
+                    yield from stream.awrite("# TYPE uhttpd_{0}_total counter\nuhttpd_{0}_total {1}\n".format(key, value))
+        yield from stream.awrite(
+            "# TYPE uhttpd_heap_free_bytes gauge\nuhttpd_heap_free_bytes {}\n"
+            "# TYPE uhttpd_heap_alloc_bytes gauge\nuhttpd_heap_alloc_bytes {}\n".format(
+                gc.mem_free(), gc.mem_alloc()
+            )
+        )
+
+
+class MeteredReader:
+    #
+    # Wraps a stream reader, counting the bytes read from it
+    #
+    def __init__(self, reader):
+        self._reader = reader
+        self.count = 0
+
+    def readline(self):
+        data = yield from self._reader.readline()
+        self.count += len(data)
+        return data
+
+    def read(self, n=-1):
+        data = yield from self._reader.read(n)
+        self.count += len(data)
+        return data
+
+
+class MeteredWriter:
+    #
+    # Wraps a stream writer, counting the bytes written to it, and recording
+    # the status code of the response from the status line, which is the
+    # start of the first write after a reset.
+    #
+    def __init__(self, writer):
+        self._writer = writer
+        self.extra = writer.extra
+        self.count = 0
+        self.code = 0
+
+    def reset(self):
+        self.count = 0
+        self.code = 0
+
+    def awrite(self, buf, off=0, sz=-1):
+        if sz == -1:
+            sz = len(buf) - off
+        if self.code == 0 and sz >= 12:
+            self.code = (buf[off + 9] - 48) * 100 + (buf[off + 10] - 48) * 10 + buf[off + 11] - 48
+        self.count += sz
+        yield from self._writer.awrite(buf, off, sz)
+
+    def flush(self):
+        yield from self._writer.flush()
+
+    def aclose(self):
+        yield from self._writer.aclose()
+
+
+class Handler:
+    #
+    # Serves the metrics collected by a Metrics instance, in the Prometheus
+    # text exposition format
+    #
+    def __init__(self, metrics):
+        self._metrics = metrics
+
+    def handle_request(self, http_request):
+        if http_request['verb'] != 'get':
+            raise uhttpd.BadRequestException("Unsupported HTTP verb: {}".format(http_request['verb']))
+        metrics = self._metrics
+        return {
+            'code': 200,
+            'headers': {
+                'content-type': "text/plain; version=0.0.4"
+            },
+            'body': lambda stream: metrics.write(stream)
+        }
@@ -0,0 +1,154 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+class PrefixRouter:
+    #
+    # Maps string prefixes to handlers.  Prefixes are compiled into a
+    # character trie, so finding a handler costs at most one dictionary
+    # lookup per character of the longest prefix, regardless of the number
+    # of prefixes.  As with a linear scan of the (ordered) list of pairs,
+    # the first registered prefix that matches the path wins.
+    #
+    def __init__(self, entries):
+        self._root = {}
+        self._depth = 0
+        i = 0
+        for prefix, handler in entries:
+            node = self._root
+            for c in prefix:
+                child = node.get(c)
+                if child is None:
+                    child = node[c] = {}
+                node = child
+            if None not in node:
+                node[None] = (i, prefix, handler)
+            self._depth = max(self._depth, len(prefix))
+            i += 1
+
+    def find(self, path):
+        node = self._root
+        best = node.get(None)
+        n = min(len(path), self._depth)
+        i = 0
+        while i < n:
+            node = node.get(path[i])
+            if node is None:
+                break
+            entry = node.get(None)
+            if entry is not None and (best is None or entry[0] < best[0]):
+                best = entry
+            i += 1
+        return best
+
+
+class Router:
+    #
+    # Maps lists of path components to handlers.  Components are compiled
+    # into a trie.  A component of the form "{name}" matches any single
+    # component, which is then bound to name in the returned params.  As
+    # with a linear scan of the (ordered) list of routes, the first
+    # registered route that is a prefix of the path wins.
+    #
+    # A handler is either an object implementing one or more of the verbs
+    # in VERBS as methods, or a dictionary mapping verbs to functions.
+    # Either way, the handler is compiled into a dictionary of verb to
+    # callable when the route is added.
+    #
+    # A route is a (prefix, handler) pair, or a (prefix, handler, ttl)
+    # triple, where ttl is the number of seconds for which responses to
+    # get requests on the route may be cached.
+    #
+    VERBS = ('get', 'put', 'post', 'delete')
+
+    def __init__(self, routes):
+        self._root = Router.new_node()
+        i = 0
+        for route in routes:
+            self.add(i, route[0], route[1], route[2] if len(route) > 2 else None)
+            i += 1
+
+    def add(self, index, prefix, handler, ttl=None):
+        node = self._root
+        for component in prefix:
+            if len(component) > 2 and component[0] == '{' and component[-1] == '}':
+                child = node[1]
+                if child is None:
+                    child = node[1] = Router.new_node()
+                    node[2] = component[1:-1]
+                elif node[2] != component[1:-1]:
+                    raise Exception("Conflicting parameter names {{{}}} and {}".format(node[2], component))
+            else:
+                child = node[0].get(component)
+                if child is None:
+                    child = node[0][component] = Router.new_node()
+            node = child
+        if node[3] is None:
+            node[3] = (index, prefix, handler, Router.verbs(handler), ttl)
+
+    #
+    # Returns (prefix, handler, verbs, context, params, ttl) for the first
+    # route matching components, or None, if there is no match.
+    #
+    def find(self, components):
+        match = self.search(self._root, components, 0, None, None)
+        if match is None:
+            return None
+        entry, depth, params = match
+        return entry[1], entry[2], entry[3], components[depth:], params if params else {}, entry[4]
+
+    def search(self, node, components, depth, params, best):
+        entry = node[3]
+        if entry is not None and (best is None or entry[0] < best[0][0]):
+            best = (entry, depth, params)
+        if depth == len(components):
+            return best
+        component = components[depth]
+        child = node[0].get(component)
+        if child is not None:
+            best = self.search(child, components, depth + 1, params, best)
+        child = node[1]
+        if child is not None:
+            bound = dict(params) if params else {}
+            bound[node[2]] = component
+            best = self.search(child, components, depth + 1, bound, best)
+        return best
+
+    @staticmethod
+    def new_node():
+        # [literal children, parameter child, parameter name, entry]
+        return [{}, None, None, None]
+
+    @staticmethod
+    def verbs(handler):
+        if type(handler) is dict:
+            return handler
+        ret = {}
+        for verb in Router.VERBS:
+            f = getattr(handler, verb, None)
+            if f is not None:
+                ret[verb] = f
+        return ret
@@ -0,0 +1,206 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import ujson
+import uasyncio as asyncio
+import uhttpd
+
+
+def format_event(data, event=None, event_id=None):
+    #
+    # Returns the text/event-stream encoding of an event, as bytes.
+    # Dictionaries and lists are encoded as JSON; anything else is
+    # converted to a string, each line of which is sent as a data field.
+    #
+    data_type = type(data)
+    if data_type is dict or data_type is list:
+        data = ujson.dumps(data)
+    elif data_type is bytes:
+        data = data.decode('UTF-8')
+    else:
+        data = str(data)
+    ret = ""
+    if event_id is not None:
+        ret += "id: {}\n".format(event_id)
+    if event:
+        ret += "event: {}\n".format(event)
+    for line in data.split('\n'):
+        ret += "data: {}\n".format(line)
+    return (ret + "\n").encode('UTF-8')
+
+
+class Subscription:
+    #
+    # The events published to a single subscriber, and not yet sent.  If
+    # the subscriber falls more than max_pending events behind, the oldest
+    # events are dropped.
+    #
+    def __init__(self, max_pending):
+        self._pending = []
+        self._max_pending = max_pending
+        self.dropped = 0
+
+    def put(self, message):
+        pending = self._pending
+        if len(pending) >= self._max_pending:
+            pending.pop(0)
+            self.dropped += 1
+        pending.append(message)
+
+    def get(self):
+        pending = self._pending
+        return pending.pop(0) if pending else None
+
+
+class Hub:
+    #
+    # Fans events out to subscribers.  Each event is encoded once, when it
+    # is published, and the encoded bytes are shared by all subscribers.
+    # Events are numbered, and the last history events are kept, so that
+    # new subscribers can be sent the latest state, and reconnecting
+    # subscribers can be sent the events they missed.
+    #
+    def __init__(self, max_subscribers=2, max_pending=8, history=1):
+        self._subscribers = []
+        self._max_subscribers = max_subscribers
+        self._max_pending = max_pending
+        self._history = []
+        self._max_history = history
+        self._next_id = 1
+
+    def publish(self, data, event=None):
+        event_id = self._next_id
+        self._next_id += 1
+        message = format_event(data, event, event_id)
+        if self._max_history > 0:
+            history = self._history
+            if len(history) >= self._max_history:
+                history.pop(0)
+            history.append((event_id, message))
+        for subscription in self._subscribers:
+            subscription.put(message)
+        return event_id
+
+    def is_full(self):
+        return len(self._subscribers) >= self._max_subscribers
+
+    def subscribe(self, last_event_id=None):
+        subscription = Subscription(self._max_pending)
+        for event_id, message in self._history:
+            if last_event_id is None or event_id > last_event_id:
+                subscription.put(message)
+        self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self._subscribers:
+            self._subscribers.remove(subscription)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+
+class Handler:
+    #
+    # Streams the events published to a Hub to clients, as Server-Sent
+    # Events.  The response has no content-length, so it is sent chunked
+    # to HTTP/1.1 clients; if the stream ends, the terminating chunk is
+    # written and the connection is kept alive for the next request.
+    # (HTTP/1.0 clients are sent a body delimited by closing the
+    # connection.)  In practice the stream ends when the client goes away.
+    # While there are no events to send, the subscription is polled every
+    # poll_ms milliseconds, and a comment is sent every keepalive seconds,
+    # so that clients that have gone away are noticed.
+    #
+    def __init__(self, hub, poll_ms=100, keepalive=15, retry=None):
+        self._hub = hub
+        self._poll_ms = poll_ms
+        self._keepalive_ms = keepalive * 1000
+        self._retry = retry
+
+    def handle_request(self, http_request):
+        if http_request['verb'] != 'get':
+            raise uhttpd.BadRequestException("Unsupported HTTP verb: {}".format(http_request['verb']))
+        if self._hub.is_full():
+            return {
+                'code': 503,
+                'headers': {
+                    'retry-after': self._retry if self._retry else 5
+                }
+            }
+        last_event_id = http_request['headers'].get('last-event-id')
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+        return {
+            'code': 200,
+            'headers': {
+                'content-type': "text/event-stream",
+                'cache-control': "no-cache"
+            },
+            'body': lambda stream: self.stream_events(stream, last_event_id)
+        }
+
+    #
+    # Internal operations
+    #
+
+    def stream_events(self, stream, last_event_id):
+        hub = self._hub
+        subscription = hub.subscribe(last_event_id)
+        try:
+            #
+            # Send the headers (along with a retry interval or a comment)
+            # right away, so the client knows the stream is open
+            #
+            if self._retry:
+                yield from stream.awrite("retry: {}\n\n".format(self._retry * 1000))
+            else:
+                yield from stream.awrite(b":\n\n")
+            yield from stream.flush()
+            idle_ms = 0
+            while True:
+                message = subscription.get()
+                if message is None:
+                    if idle_ms >= self._keepalive_ms:
+                        yield from stream.awrite(b":\n\n")
+                        yield from stream.flush()
+                        idle_ms = 0
+                    yield from asyncio.sleep_ms(self._poll_ms)
+                    idle_ms += self._poll_ms
+                    continue
+                while message is not None:
+                    yield from stream.awrite(message)
+                    message = subscription.get()
+                yield from stream.flush()
+                idle_ms = 0
+        except OSError:
+            #
+            # The client has gone away, which is how event streams end
+            #
+            pass
+        finally:
+            hub.unsubscribe(subscription)
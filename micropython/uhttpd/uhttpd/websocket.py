@@ -0,0 +1,278 @@
+#
+# Copyright (c) dushin.net  All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of dushin.net nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY dushin.net ``AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL dushin.net BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import ubinascii
+import uhashlib
+import ustruct
+import uhttpd
+
+#
+# The GUID concatenated with the client's key to compute the accept key
+# (RFC 6455, section 1.3)
+#
+GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_INVALID_DATA = 1007
+CLOSE_TOO_BIG = 1009
+
+
+class ProtocolException(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def accept_key(key):
+    return ubinascii.b2a_base64(uhashlib.sha1(key.encode() + GUID).digest()).strip()
+
+
+def unmask(data, mask):
+    #
+    # XOR the payload with the (repeated) masking key.  Rather than XORing a
+    # byte at a time in python, the payload and key are converted to
+    # integers, so that the XOR is done in a single (native) operation.
+    #
+    n = len(data)
+    if n == 0:
+        return data
+    key = (mask * ((n + 3) // 4))[:n]
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(key, 'little')).to_bytes(n, 'little')
+
+
+def read_exactly(reader, n):
+    data = b''
+    while len(data) < n:
+        chunk = yield from reader.read(n - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+class WebSocket:
+    #
+    # A WebSocket connection, as seen by the server.  recv returns the next
+    # message (a str, for text messages, or bytes, for binary messages),
+    # reassembling fragmented messages, and answering pings and close
+    # frames as they arrive.  recv returns None once the connection is
+    # closed.
+    #
+    def __init__(self, reader, writer, http_request, max_message_size=4096, timeout=None):
+        self._reader = reader
+        self._writer = writer
+        self._max_message_size = max_message_size
+        self._timeout = timeout
+        self.http_request = http_request
+        self.closed = False
+
+    def recv(self):
+        message = None
+        message_op = None
+        while not self.closed:
+            try:
+                fin, op, payload = yield from uhttpd.read_within(self.read_frame(), self._timeout)
+            except EOFError:
+                self.closed = True
+                return None
+            except uhttpd.RequestTimeoutException:
+                yield from self.close(CLOSE_GOING_AWAY)
+                return None
+            except ProtocolException as e:
+                yield from self.close(e.code)
+                return None
+            if op == OP_PING:
+                yield from self.send_frame(OP_PONG, payload)
+                continue
+            if op == OP_PONG:
+                continue
+            if op == OP_CLOSE:
+                code = ustruct.unpack('>H', payload[:2])[0] if len(payload) >= 2 else CLOSE_NORMAL
+                yield from self.close(code)
+                return None
+            if op == OP_CONTINUATION:
+                if message is None:
+                    yield from self.close(CLOSE_PROTOCOL_ERROR)
+                    return None
+                if len(message) + len(payload) > self._max_message_size:
+                    yield from self.close(CLOSE_TOO_BIG)
+                    return None
+                message += payload
+            elif op == OP_TEXT or op == OP_BINARY:
+                if message is not None:
+                    yield from self.close(CLOSE_PROTOCOL_ERROR)
+                    return None
+                message = payload
+                message_op = op
+            else:
+                yield from self.close(CLOSE_PROTOCOL_ERROR)
+                return None
+            if fin:
+                if message_op == OP_BINARY:
+                    return message
+                try:
+                    return message.decode('UTF-8')
+                except UnicodeError:
+                    yield from self.close(CLOSE_INVALID_DATA)
+                    return None
+        return None
+
+    def send(self, data):
+        if type(data) is str:
+            yield from self.send_frame(OP_TEXT, data.encode('UTF-8'))
+        else:
+            yield from self.send_frame(OP_BINARY, data)
+
+    def ping(self, data=b''):
+        yield from self.send_frame(OP_PING, data)
+
+    def close(self, code=CLOSE_NORMAL, reason=''):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            yield from self.send_frame(OP_CLOSE, ustruct.pack('>H', code) + reason.encode('UTF-8'))
+        except OSError:
+            pass
+
+    #
+    # Internal operations
+    #
+
+    def read_frame(self):
+        #
+        # Returns (fin, opcode, payload) for the next frame.  Frames from
+        # clients must be masked.
+        #
+        reader = self._reader
+        header = yield from read_exactly(reader, 2)
+        b0 = header[0]
+        b1 = header[1]
+        fin = b0 & 0x80
+        op = b0 & 0x0F
+        if b0 & 0x70:
+            raise ProtocolException(CLOSE_PROTOCOL_ERROR, "Unsupported extension")
+        if not b1 & 0x80:
+            raise ProtocolException(CLOSE_PROTOCOL_ERROR, "Unmasked client frame")
+        length = b1 & 0x7F
+        if op & 0x8 and (length > 125 or not fin):
+            raise ProtocolException(CLOSE_PROTOCOL_ERROR, "Invalid control frame")
+        if length == 126:
+            length = ustruct.unpack('>H', (yield from read_exactly(reader, 2)))[0]
+        elif length == 127:
+            length = ustruct.unpack('>Q', (yield from read_exactly(reader, 8)))[0]
+        if length > self._max_message_size:
+            raise ProtocolException(CLOSE_TOO_BIG, "Frame too big")
+        mask = yield from read_exactly(reader, 4)
+        payload = yield from read_exactly(reader, length)
+        return fin, op, unmask(payload, mask)
+
+    def send_frame(self, op, payload):
+        n = len(payload)
+        if n < 126:
+            header = ustruct.pack('BB', 0x80 | op, n)
+        elif n < 0x10000:
+            header = ustruct.pack('>BBH', 0x80 | op, 126, n)
+        else:
+            header = ustruct.pack('>BBQ', 0x80 | op, 127, n)
+        writer = self._writer
+        yield from writer.awrite(header)
+        if n:
+            yield from writer.awrite(payload)
+        yield from writer.flush()
+
+
+class Handler:
+    #
+    # Accepts WebSocket connections (RFC 6455), and runs callback(ws) on
+    # each one, where callback is a coroutine (generator function) and ws is
+    # a WebSocket.  The connection is closed when the callback returns.
+    # Each connection holds one of the server's connection slots for as
+    # long as it is open.
+    #
+    def __init__(self, callback, max_message_size=4096, timeout=None, protocols=None):
+        self._callback = callback
+        self._max_message_size = max_message_size
+        self._timeout = timeout
+        self._protocols = protocols
+
+    def handle_request(self, http_request):
+        headers = http_request['headers']
+        if http_request['verb'] != 'get' \
+                or headers.get('upgrade', '').lower() != 'websocket' \
+                or 'upgrade' not in headers.get('connection', '').lower():
+            raise uhttpd.BadRequestException("Not a WebSocket handshake")
+        key = headers.get('sec-websocket-key')
+        if not key:
+            raise uhttpd.BadRequestException("Missing sec-websocket-key")
+        if headers.get('sec-websocket-version') != '13':
+            return {
+                'code': 426,
+                'headers': {
+                    'sec-websocket-version': '13'
+                }
+            }
+        response_headers = {
+            'upgrade': 'websocket',
+            'connection': 'Upgrade',
+            'sec-websocket-accept': accept_key(key)
+        }
+        protocol = self.select_protocol(headers.get('sec-websocket-protocol'))
+        if protocol:
+            response_headers['sec-websocket-protocol'] = protocol
+        return {
+            'code': 101,
+            'headers': response_headers,
+            'upgrade': lambda reader, writer: self.serve(reader, writer, http_request)
+        }
+
+    #
+    # Internal operations
+    #
+
+    def select_protocol(self, requested):
+        if not requested or not self._protocols:
+            return None
+        for protocol in requested.split(','):
+            protocol = protocol.strip()
+            if protocol in self._protocols:
+                return protocol
+        return None
+
+    def serve(self, reader, writer, http_request):
+        ws = WebSocket(reader, writer, http_request, self._max_message_size, self._timeout)
+        try:
+            yield from self._callback(ws)
+        finally:
+            yield from ws.close()
@@ -48,7 +48,7 @@ def wc():
         (['memory'], api.MemoryAPIHandler()),
         (['flash'], api.FlashAPIHandler()),
         (['network'], api.NetworkAPIHandler())
-    ])
+    ], stream_json=True)
     file_handler = uhttpd.file_handler.Handler(block_size=256)
     server = uhttpd.Server([
         ('/api', api_handler),